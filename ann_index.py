@@ -0,0 +1,120 @@
+import numpy as np
+
+# Rows scored against the centroids at a time, to bound temporary memory.
+_CHUNK_ROWS = 8192
+
+
+def _nearest_cells(vectors, centroids, centroid_norms, count=1):
+    """Indices of the `count` closest centroids for each vector."""
+    cells = np.empty((len(vectors), count), dtype=np.intp)
+    for start in range(0, len(vectors), _CHUNK_ROWS):
+        chunk = vectors[start:start + _CHUNK_ROWS]
+        # |v|^2 is the same for every centroid, so it can be left out of the ranking.
+        scores = centroid_norms[None, :] - 2.0 * (chunk @ centroids.T)
+        if count == 1:
+            cells[start:start + len(chunk), 0] = scores.argmin(axis=1)
+        else:
+            cells[start:start + len(chunk)] = np.argpartition(scores, count - 1, axis=1)[:, :count]
+    return cells
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index over face encodings.
+
+    The gallery is partitioned into k-means cells; a query only looks at the
+    rows in its `nprobe` closest cells, and the caller verifies those
+    candidates with exact distances. Rows are identified by their position
+    in the FaceMatcher gallery, and the index is told about every add and
+    swap-remove so it never needs retraining for small changes.
+    """
+
+    def __init__(self, nlist=None, nprobe=8, iterations=10, sample_per_cell=64, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.sample_per_cell = sample_per_cell
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self._cells = np.empty(0, dtype=np.intp)
+        self._order = None
+
+    def train(self, gallery):
+        """Fit the cell centroids with k-means on a sample of the gallery."""
+        rng = np.random.default_rng(self.seed)
+        n = len(gallery)
+        nlist = min(n, self.nlist or max(1, int(round(np.sqrt(n)))))
+        sample_size = min(n, nlist * self.sample_per_cell)
+        sample = np.asarray(gallery[np.sort(rng.choice(n, sample_size, replace=False))], dtype=np.float64)
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            norms = np.einsum('ij,ij->i', centroids, centroids)
+            labels = _nearest_cells(sample, centroids, norms)[:, 0]
+            counts = np.bincount(labels, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            # Re-seed empty cells from random sample points.
+            empty = np.flatnonzero(~filled)
+            if len(empty):
+                centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+        self.centroids = centroids
+        self._centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+        self.trained_size = n
+
+    def reset(self, gallery):
+        """
+        Assign every gallery row to a cell. The centroids are retrained only
+        when the gallery has doubled or halved since they were fitted.
+        """
+        n = len(gallery)
+        if self.centroids is None or not (self.trained_size / 2 <= n <= self.trained_size * 2):
+            self.train(gallery)
+        self._cells = _nearest_cells(gallery, self.centroids, self._centroid_norms)[:, 0]
+        self._order = None
+
+    def state(self):
+        """(centroids, trained_size, cells) for saving with a gallery snapshot."""
+        return self.centroids, self.trained_size, self._cells
+
+    def restore(self, centroids, trained_size, cells):
+        """
+        Take over centroids and cell assignments saved by state(), so another
+        process needs neither k-means nor a full reassignment.
+        """
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        self._centroid_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self.trained_size = int(trained_size)
+        # A private copy: set() and remove() write to it.
+        self._cells = np.array(cells, dtype=np.intp)
+        self._order = None
+
+    def set(self, row, vector):
+        """Record the cell of a new (row == len) or replaced gallery row."""
+        cell = _nearest_cells(np.asarray(vector, dtype=np.float64)[None, :], self.centroids, self._centroid_norms)[0, 0]
+        if row == len(self._cells):
+            self._cells = np.append(self._cells, cell)
+        else:
+            self._cells[row] = cell
+        self._order = None
+
+    def remove(self, row, last):
+        """Mirror FaceMatcher.remove: the last row moves into `row`."""
+        self._cells[row] = self._cells[last]
+        self._cells = self._cells[:last]
+        self._order = None
+
+    def search_rows(self, faces):
+        """Returns, for each query face, the gallery rows in its nprobe closest cells."""
+        if self._order is None:
+            # Rebuilt lazily so a burst of enrollments pays for one sort.
+            self._order = np.argsort(self._cells, kind='stable')
+            self._bounds = np.searchsorted(self._cells[self._order], np.arange(len(self.centroids) + 1))
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = _nearest_cells(np.asarray(faces, dtype=np.float64), self.centroids, self._centroid_norms, nprobe)
+        return [
+            np.concatenate([self._order[self._bounds[c]:self._bounds[c + 1]] for c in cells])
+            for cells in probes
+        ]
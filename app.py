@@ -1,52 +1,584 @@
 from flask import flash
 from flask import session, redirect, url_for, render_template
-from models import db, Student, Admin,AttendanceRecord, Lecturer, Qualification, Module
+from models import db, Student, Admin, Lecturer, Qualification, Module
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 import numpy as np
 import datetime
 import face_recognition
-from flask import Flask, request, jsonify
-from models import db, Student
+from flask import Flask, request, jsonify, g, has_request_context
+from models import db, Student, GalleryState, RecognitionJob
+from face_matcher import FaceMatcher
+from ann_index import IVFIndex
+from gallery_store import GalleryStore
+from attendance_writer import record_attendance, open_live_session, record_live_scan, close_live_session, live_session_arrivals
+from attendance_writer import student_attendance, close_stale_live_sessions
+from query_plans import HOT_TABLES, hot_queries, query_plans, plan_problems
+from recognition_jobs import JobQueue, QueueFull, encode_faces
+from parallel_encoding import encode_faces_parallel
+from face_tracker import FaceTracker
+from live_state import SessionRegistry, FramePacer, FrameDropped
+from encoding_cache import EncodingCache
+from pipeline_metrics import PipelineMetrics
+from bulk_enrollment import open_photo_source, read_manifest, import_students
+from image_ingest import load_image, ImageRejected
+from face_quality import assess_faces
+from encoding_format import pack, unpack, describe, DTYPES
+from face_templates import student_templates, nearest_template, add_template, gallery_templates
+import click
+import threading
+import face_detection
+import base64
+import io
+from concurrent.futures import Future
+import json
+import math
+import time
+import uuid
 
 from functools import wraps
 
 
 
 
-# Initialize the Flask application
-app = Flask(__name__)
+# Initialize the Flask application. INSTANCE_PATH (absolute) moves the
+# database, gallery snapshots and caches out of ./instance, e.g. for benchmarks.
+app = Flask(__name__, instance_path=os.environ.get('INSTANCE_PATH'))
 
 # Configure the database connection string.
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Maximum face distance for a detected face to count as an enrolled student.
+app.config['FACE_MATCH_TOLERANCE'] = 0.5
+# Resolve matches one-to-one so a face can never mark more than one student present.
+app.config['FACE_MATCH_ONE_TO_ONE'] = True
+# Minimum gap between a face's best and second-best distance (0 disables the check).
+app.config['FACE_MATCH_MARGIN'] = 0.0
+# When a register is for one qualification, faces that match nobody in that
+# cohort are retried against every enrolled student (visiting students).
+app.config['FACE_MATCH_FALLBACK_ALL'] = False
+# Background recognition: pool processes per web worker, and how many photos
+# may be queued or running before uploads are turned away with a 503.
+app.config['RECOGNITION_WORKERS'] = 2
+app.config['RECOGNITION_MAX_PENDING'] = 8
+# Uploads are decoded once, JPEGs straight to the smallest DCT-scaled size
+# whose longest side is still at least DETECTION_MAX_SIDE, or at full size
+# when they reach DETECTION_TILE_MIN_SIDE and will be tiled (see below).
+# Larger uploads are refused before decoding.
+app.config['IMAGE_MAX_PIXELS'] = 50 * 1000 * 1000
+app.config['IMAGE_MAX_BYTES'] = 20 * 1024 * 1024
+# Quality gate between detection and encoding: faces whose box is under
+# FACE_MIN_SIZE pixels, whose sharpness (Laplacian variance of a 64x64 crop)
+# is under FACE_MIN_SHARPNESS, or that are turned further than FACE_MAX_YAW
+# (nose offset in eye distances, about 1 in profile) are reported as
+# rejected instead of encoded. 0 turns a check off.
+app.config['FACE_MIN_SIZE'] = 40
+app.config['FACE_MIN_SHARPNESS'] = 10.0
+app.config['FACE_MAX_YAW'] = 0.7
+# Face detection runs on a copy whose longest side is at most this many pixels
+# (0 = full resolution); with the pyramid on, a level that finds nobody is
+# retried at twice the scale.
+app.config['DETECTION_MAX_SIDE'] = 1600
+app.config['DETECTION_PYRAMID'] = True
+# Group photos whose longest side reaches DETECTION_TILE_MIN_SIDE (0 = never)
+# are also searched in overlapping full-resolution tiles, so small faces at the
+# back of a lecture hall are not lost to downscaling. Tiling costs several
+# times a downscaled pass, so phone photos (4032x3024) and 4K captures stay
+# on the downscaled path and its pyramid; enrollment photos are never tiled.
+app.config['DETECTION_TILE_MIN_SIDE'] = 6000
+app.config['DETECTION_TILE_SIZE'] = 1600
+app.config['DETECTION_TILE_OVERLAP'] = 200
+# Processes used to encode the faces (and detect the tiles) of one photo; 1 works in-process.
+# Only photos with at least ENCODING_MIN_FACES_PER_WORKER faces per process are split.
+app.config['ENCODING_WORKERS'] = int(os.environ.get('ENCODING_WORKERS', 1))
+app.config['ENCODING_MIN_FACES_PER_WORKER'] = 4
+# Uploaded photos whose faces were already encoded are served from a cache of
+# this many photos per worker; set ENCODING_CACHE_DIR to also keep them on disk,
+# shared between workers and restarts.
+app.config['ENCODING_CACHE_SIZE'] = 256
+app.config['ENCODING_CACHE_DIR'] = os.environ.get('ENCODING_CACHE_DIR')
+# When set, /metrics requires "Authorization: Bearer <token>".
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+# Processes used by bulk student imports to encode photos and hash passwords.
+app.config['IMPORT_WORKERS'] = int(os.environ.get('IMPORT_WORKERS', os.cpu_count() or 1))
+# Students can hold up to FACE_TEMPLATES_MAX encodings (enrollment photo,
+# photos added later, learned ones); the gallery holds their centroid, and a
+# face whose centroid distance is within FACE_TEMPLATE_REFINE_WINDOW of the
+# tolerance is rescored against the student's templates.
+app.config['FACE_TEMPLATES_MAX'] = 5
+app.config['FACE_TEMPLATE_REFINE_WINDOW'] = 0.1
+# With FACE_TEMPLATE_LEARN, a face recognised within FACE_TEMPLATE_LEARN_DISTANCE
+# that is at least FACE_TEMPLATE_MIN_NOVELTY away from all of the student's
+# templates is added as a new one, following gradual changes in appearance.
+# Learned templates replace each other, oldest first, once the student is full.
+app.config['FACE_TEMPLATE_LEARN'] = False
+app.config['FACE_TEMPLATE_LEARN_DISTANCE'] = 0.35
+app.config['FACE_TEMPLATE_MIN_NOVELTY'] = 0.15
+# Face encodings are stored in the database as ENCODING_STORAGE_DTYPE
+# ('float64', 'float32' or 'int8', see encoding_format; older raw float64
+# encodings are still read) and held in the matching gallery as GALLERY_DTYPE.
+# The migrate-encodings command rewrites existing rows.
+app.config['ENCODING_STORAGE_DTYPE'] = 'float32'
+app.config['GALLERY_DTYPE'] = 'float32'
+# Galleries at least this large are searched through the approximate IVF index.
+app.config['ANN_MIN_GALLERY_SIZE'] = 20000
+# Number of index cells scanned per detected face; higher trades speed for recall.
+app.config['ANN_NPROBE'] = 8
+# Live attendance follows faces between frames: a box overlapping last frame's
+# box by at least LIVE_TRACK_IOU keeps its track, and once a track has matched
+# the same student LIVE_TRACK_CONFIRM_AFTER times in a row it is no longer
+# re-encoded, except every LIVE_TRACK_REVERIFY_EVERY frames.
+app.config['LIVE_TRACK_IOU'] = 0.4
+app.config['LIVE_TRACK_CONFIRM_AFTER'] = 2
+app.config['LIVE_TRACK_REVERIFY_EVERY'] = 12
+# Live pages that support server-sent events push frames to a per-session
+# endpoint and receive newly recognised students over one event stream. The
+# stream polls for arrivals every LIVE_EVENTS_POLL_SECONDS and ends after
+# LIVE_EVENTS_STREAM_SECONDS, when the browser reconnects and resumes. Each
+# open stream holds one gunicorn thread (see the Procfile), so a worker serves
+# at most LIVE_EVENTS_MAX_STREAMS at once and keeps its other threads for
+# frames and pages; further streams get a 503 and the page falls back to
+# per-frame results.
+app.config['LIVE_EVENTS_POLL_SECONDS'] = 1.0
+app.config['LIVE_EVENTS_STREAM_SECONDS'] = 25
+app.config['LIVE_EVENTS_MAX_STREAMS'] = int(os.environ.get('LIVE_EVENTS_MAX_STREAMS', 24))
+# Bounds, in seconds, of the frame interval suggested to live pages; within
+# them it follows 1.5x the session's average frame processing time.
+app.config['LIVE_MIN_INTERVAL'] = 2.0
+app.config['LIVE_MAX_INTERVAL'] = 30.0
+# Live sessions left open (the page was closed without stopping) are closed
+# once they are this old, instead of being resumed by a later lecture; the
+# live page and `flask close-live-sessions` (e.g. from cron) sweep them.
+app.config['LIVE_SESSION_MAX_AGE'] = datetime.timedelta(hours=4)
 
 # Initialize the database with the Flask app.
 db.init_app(app)
 
-# Global variables to store face encodings and student IDs.
-# We'll load these once when the application starts to improve performance.
-known_face_encodings = []
-known_student_ids = []
+# Gallery of enrolled face encodings, held as one matrix for batched matching.
+# Every worker maps the same versioned snapshot from the instance folder and
+# re-maps it when another worker publishes a newer version.
+face_matcher = FaceMatcher(
+    dtype=np.dtype(app.config['GALLERY_DTYPE']),
+    index=IVFIndex(nprobe=app.config['ANN_NPROBE']),
+    index_min_size=app.config['ANN_MIN_GALLERY_SIZE'],
+    refine_window=app.config['FACE_TEMPLATE_REFINE_WINDOW']
+)
+gallery_store = GalleryStore(os.path.join(app.instance_path, 'gallery'))
+loaded_gallery_version = None
+
+# Per-stage timings of the recognition routes, served at /metrics.
+pipeline_metrics = PipelineMetrics()
+
+
+def timed(stage):
+    """
+    Context manager timing one stage (decode, detect, encode, match, ...) of
+    the current request or recognition job. Durations feed the /metrics
+    histograms and the request's structured log line.
+    """
+    route = g.get('pipeline_route') or (request.endpoint if has_request_context() else 'recognition_job')
+    return pipeline_metrics.time(route, stage, g.setdefault('stage_timings', {}))
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def log_recognition_request(response):
+    # One JSON line per request that ran any pipeline stage.
+    timings = g.get('stage_timings')
+    if timings:
+        print(json.dumps({
+            "event": "recognition_request",
+            "route": request.endpoint,
+            "status": response.status_code,
+            "duration_ms": round((time.perf_counter() - g.request_started) * 1000, 1),
+            "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()},
+        }))
+    return response
+
 
 def load_known_faces():
     """
-    Loads all student face encodings from the database into memory.
-    This function is called once at application startup.
+    Loads all student face encodings from the database and publishes them as
+    a new shared gallery version. Called when no snapshot exists yet or via
+    the load-faces command; enrollments and deletions afterwards update the
+    gallery incrementally.
     """
-    global known_face_encodings, known_student_ids
-    with app.app_context():
+    with app.app_context(), gallery_store.lock():
         # Query all students from the database
         students = Student.query.all()
-        # Clear existing lists
         known_face_encodings = []
         known_student_ids = []
+        known_qualification_ids = []
         for student in students:
             # Convert the binary face encoding from the database back to a NumPy array
-            face_array = np.frombuffer(student.face_encoding, dtype=np.float64)
+            face_array = unpack(student.face_encoding, face_matcher.dtype)
             known_face_encodings.append(face_array)
             known_student_ids.append(student.student_id_number)
-        print(f"Loaded {len(known_face_encodings)} student face encodings.")
+            known_qualification_ids.append(student.qualification_id)
+        face_matcher.load(known_face_encodings, known_student_ids, known_qualification_ids, gallery_templates())
+        publish_gallery()
+        print(f"Loaded {len(face_matcher)} student face encodings.")
+
+
+def current_gallery_version():
+    state = GalleryState.query.get(1)
+    return state.version if state else 0
+
+
+def publish_gallery():
+    """
+    Writes the in-memory gallery as the next shared version and records it in
+    the database, then maps that snapshot in place of this worker's private
+    copy so it is shared like everyone else's. Callers must hold
+    gallery_store.lock().
+    """
+    global loaded_gallery_version
+    state = GalleryState.query.get(1)
+    if state is None:
+        state = GalleryState(id=1, version=0)
+        db.session.add(state)
+    version = state.version + 1
+    gallery_store.write(
+        version, face_matcher.encodings, face_matcher.sq_norms, face_matcher.groups, face_matcher.student_ids,
+        face_matcher.templates, face_matcher.index_state()
+    )
+    state.version = version
+    db.session.commit()
+    face_matcher.adopt(*gallery_store.read(version))
+    loaded_gallery_version = version
+
+
+def sync_gallery():
+    """
+    Maps the latest shared gallery snapshot if another worker has published
+    one since we last looked. Costs a single primary-key query when current.
+    """
+    global loaded_gallery_version
+    version = current_gallery_version()
+    if version == loaded_gallery_version:
+        return
+    snapshot = gallery_store.read(version) if version else None
+    if snapshot is None:
+        # No snapshot on disk yet (first start or a fresh instance folder).
+        load_known_faces()
+        return
+    face_matcher.adopt(*snapshot)
+    loaded_gallery_version = version
+
+
+def update_gallery(student_id, encoding=None, qualification_id=None, templates=None):
+    """
+    Applies a single enrollment (encoding given) or deletion (encoding None)
+    to the shared gallery after the database commit.
+    """
+    with gallery_store.lock():
+        sync_gallery()
+        if encoding is None:
+            face_matcher.remove(student_id)
+        else:
+            face_matcher.add(student_id, encoding, qualification_id, templates)
+        publish_gallery()
+
+
+def detection_options(tiled=True):
+    """
+    Keyword arguments for face_detection.find_faces taken from the app config.
+    Single-face photos (enrollment) pass tiled=False.
+    """
+    return {
+        'max_side': app.config['DETECTION_MAX_SIDE'],
+        'pyramid': app.config['DETECTION_PYRAMID'],
+        'tile_min_side': app.config['DETECTION_TILE_MIN_SIDE'] if tiled else 0,
+        'tile_size': app.config['DETECTION_TILE_SIZE'],
+        'tile_overlap': app.config['DETECTION_TILE_OVERLAP'],
+        'workers': app.config['ENCODING_WORKERS'],
+    }
+
+
+def ingest_options(tiled=True):
+    # Decoding never goes below the size detection works at.
+    return {
+        'max_side': app.config['DETECTION_MAX_SIDE'],
+        'max_pixels': app.config['IMAGE_MAX_PIXELS'],
+        'max_bytes': app.config['IMAGE_MAX_BYTES'],
+        'tile_min_side': app.config['DETECTION_TILE_MIN_SIDE'] if tiled else 0,
+    }
+
+
+def quality_options():
+    """Keyword arguments for face_quality.assess_faces taken from the app config."""
+    return {
+        'min_size': app.config['FACE_MIN_SIZE'],
+        'min_sharpness': app.config['FACE_MIN_SHARPNESS'],
+        'max_yaw': app.config['FACE_MAX_YAW'],
+    }
+
+
+def load_upload(source, tiled=True):
+    """Decodes an uploaded photo (bytes or file object) once, within the configured limits."""
+    return load_image(source, **ingest_options(tiled))
+
+
+def find_faces(image, tiled=True):
+    """
+    Face boxes in full-resolution coordinates, detected on a downscaled copy,
+    and tile by tile as well for very large group photos.
+    """
+    return face_detection.find_faces(image, **detection_options(tiled))
+
+
+def usable_faces(image, face_locations):
+    """
+    Drops detected faces too small, blurred or turned away to be worth
+    encoding. Returns (kept face_locations, rejected face dicts).
+    """
+    with timed('quality'):
+        kept, rejected = assess_faces(image, face_locations, **quality_options())
+    return [face_locations[i] for i in kept], rejected
+
+
+def compute_encodings(image, face_locations):
+    """Encodes the detected faces, across ENCODING_WORKERS processes for large group photos."""
+    return encode_faces_parallel(
+        image,
+        face_locations,
+        workers=app.config['ENCODING_WORKERS'],
+        min_faces_per_worker=app.config['ENCODING_MIN_FACES_PER_WORKER']
+    )
+
+
+def identify_faces(face_encodings, qualification_id=None):
+    """
+    Scores all detected faces against the gallery in one pass and returns a
+    (student_id_number, distance) pair per face, with None for unmatched
+    faces. When a qualification is given only that cohort is scanned.
+    """
+    with timed('gallery_sync'):
+        sync_gallery()
+    with timed('match'):
+        return face_matcher.identify(
+            face_encodings,
+            tolerance=app.config['FACE_MATCH_TOLERANCE'],
+            one_to_one=app.config['FACE_MATCH_ONE_TO_ONE'],
+            margin=app.config['FACE_MATCH_MARGIN'],
+            group=int(qualification_id) if qualification_id else None,
+            fallback=app.config['FACE_MATCH_FALLBACK_ALL']
+        )
+
+
+encoding_cache = EncodingCache(
+    max_entries=app.config['ENCODING_CACHE_SIZE'],
+    directory=app.config['ENCODING_CACHE_DIR']
+)
+
+
+def upload_cache_key(image_bytes):
+    # The worker count does not change the result, so it is left out of the key.
+    options = detection_options()
+    options.pop('workers')
+    options.update(ingest_options())
+    options.update(quality_options())
+    return EncodingCache.key(image_bytes, options)
+
+
+def encode_upload(image_bytes):
+    """
+    Detects and encodes the faces of an uploaded photo, reusing the result of
+    an earlier upload of the same bytes. Returns (face_locations,
+    face_encodings, rejected) where rejected lists the faces the quality
+    gate kept out of encoding.
+    """
+    key = upload_cache_key(image_bytes)
+    cached = encoding_cache.get(key)
+    if cached is not None:
+        return cached
+    with timed('decode'):
+        image = load_upload(image_bytes)
+    with timed('detect'):
+        face_locations = find_faces(image)
+    face_locations, rejected = usable_faces(image, face_locations)
+    with timed('encode'):
+        face_encodings = compute_encodings(image, face_locations)
+    return encoding_cache.put(key, face_locations, face_encodings, rejected)
+
+
+def match_faces(face_encodings, qualification_id=None):
+    """
+    Scores all detected faces against the gallery in one pass and returns the
+    student ID numbers of the recognised students. When a qualification is
+    given only that cohort is scanned.
+    """
+    matches = identify_faces(face_encodings, qualification_id)
+    learn_templates(face_encodings, matches)
+    return list(dict.fromkeys(sid for sid, _ in matches if sid is not None))
+
+
+def learn_templates(face_encodings, matches):
+    """
+    With FACE_TEMPLATE_LEARN on, adds confidently recognised faces that look
+    unlike the student's existing templates as new templates, and publishes
+    the gallery once for all of them.
+    """
+    if not app.config['FACE_TEMPLATE_LEARN']:
+        return
+    confident = {
+        sid: encoding for encoding, (sid, d) in zip(face_encodings, matches)
+        if sid is not None and d <= app.config['FACE_TEMPLATE_LEARN_DISTANCE']
+    }
+    if not confident:
+        return
+    with timed('learn'):
+        learned = []
+        for student in Student.query.filter(Student.student_id_number.in_(list(confident))):
+            encoding = confident[student.student_id_number]
+            if nearest_template(student, encoding) < app.config['FACE_TEMPLATE_MIN_NOVELTY']:
+                continue
+            templates = add_template(
+                student, encoding, 'attendance', app.config['FACE_TEMPLATES_MAX'], app.config['ENCODING_STORAGE_DTYPE']
+            )
+            learned.append((student, templates))
+        if not learned:
+            return
+        db.session.commit()
+        with gallery_store.lock():
+            sync_gallery()
+            for student, templates in learned:
+                face_matcher.add(
+                    student.student_id_number, unpack(student.face_encoding, face_matcher.dtype),
+                    student.qualification_id, templates
+                )
+            publish_gallery()
+
+def uploaded_image(values, file_fields=('frame', 'image')):
+    """
+    Returns the uploaded photo or camera frame as a file object, or None.
+    Frames arrive as a multipart file part, as a raw image/* request body
+    (fields then come from the query string), or from older pages as a
+    base64 data URL in a camera_image field.
+    """
+    for field in file_fields:
+        if request.files.get(field):
+            return request.files[field].stream
+    if request.mimetype.startswith('image/'):
+        return io.BytesIO(request.get_data(cache=False))
+    data_url = values.get('camera_image')
+    if data_url:
+        header, encoded = data_url.split(',', 1)
+        return io.BytesIO(base64.b64decode(encoded))
+    return None
+
+
+# Face trackers of the live sessions served by this worker, keyed by session ID.
+live_trackers = SessionRegistry(lambda: FaceTracker(
+    iou_threshold=app.config['LIVE_TRACK_IOU'],
+    confirm_after=app.config['LIVE_TRACK_CONFIRM_AFTER'],
+    reverify_every=app.config['LIVE_TRACK_REVERIFY_EVERY']
+))
+# One frame in flight per live session; stale or overlapping frames are dropped.
+live_pacers = SessionRegistry(lambda: FramePacer(
+    min_interval=app.config['LIVE_MIN_INTERVAL'],
+    max_interval=app.config['LIVE_MAX_INTERVAL']
+))
+# Event streams open in this worker, each holding a thread until it ends.
+live_streams = threading.BoundedSemaphore(app.config['LIVE_EVENTS_MAX_STREAMS'])
+
+recognition_jobs = JobQueue(
+    max_workers=app.config['RECOGNITION_WORKERS'],
+    max_pending=app.config['RECOGNITION_MAX_PENDING']
+)
+
+
+def queue_recognition(kind, image_bytes, qualification_id=None, on_match=None):
+    """
+    Queues detection and encoding of an uploaded photo in the process pool
+    and returns a 202 response with the job ID. Once the faces are encoded
+    they are matched here and on_match(present_student_ids), if given, runs
+    inside an app context to persist the outcome; a dict it returns is added
+    to the job's result.
+    """
+    job_id = uuid.uuid4().hex
+    db.session.add(RecognitionJob(id=job_id, kind=kind, status='queued'))
+    db.session.commit()
+    cache_key = upload_cache_key(image_bytes)
+    submitted = time.perf_counter()
+
+    def finish(future, pooled=True):
+        with app.app_context():
+            g.pipeline_route = f'job_{kind}'
+            if pooled:
+                # Detection and encoding ran in the pool; timed as one stage with the queueing.
+                pipeline_metrics.observe(g.pipeline_route, 'pool', time.perf_counter() - submitted)
+            job = RecognitionJob.query.get(job_id)
+            try:
+                face_locations, face_encodings, rejected = future.result()
+                encoding_cache.put(cache_key, face_locations, face_encodings, rejected)
+                present_student_ids = match_faces(face_encodings, qualification_id) if face_encodings else []
+                result = {
+                    "faces": len(face_encodings),
+                    "rejected": rejected,
+                    "student_ids": present_student_ids
+                }
+                if on_match is not None:
+                    with timed('record'):
+                        result.update(on_match(present_student_ids) or {})
+                job.result = json.dumps(result)
+                job.status = 'done'
+            except ImageRejected as e:
+                db.session.rollback()
+                job = RecognitionJob.query.get(job_id)
+                job.result = json.dumps({"error": str(e)})
+                job.status = 'failed'
+            except Exception as e:
+                print(f"Recognition job error: {e}")
+                db.session.rollback()
+                job = RecognitionJob.query.get(job_id)
+                job.result = json.dumps({"error": "An internal error occurred"})
+                job.status = 'failed'
+            job.finished_at = datetime.datetime.utcnow()
+            try:
+                db.session.commit()
+            except Exception as e:
+                # Say, the database stayed locked; never leave the job queued for its poller.
+                print(f"Recognition job error: {e}")
+                db.session.rollback()
+                RecognitionJob.query.filter_by(id=job_id).update({
+                    'status': 'failed',
+                    'result': json.dumps({"error": "An internal error occurred"}),
+                    'finished_at': datetime.datetime.utcnow()
+                })
+                db.session.commit()
+                job = RecognitionJob.query.get(job_id)
+            print(json.dumps({
+                "event": "recognition_job",
+                "route": g.pipeline_route,
+                "job_id": job_id,
+                "status": job.status,
+                "duration_ms": round((time.perf_counter() - submitted) * 1000, 1),
+                "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in g.get('stage_timings', {}).items()},
+            }))
+
+    cached = encoding_cache.get(cache_key)
+    if cached is not None:
+        # Seen before: finish the job here without going through the pool.
+        future = Future()
+        future.set_result(cached)
+        finish(future, pooled=False)
+        return jsonify({"job_id": job_id, "status_url": url_for('recognition_job_status', job_id=job_id)}), 202
+    try:
+        recognition_jobs.submit(
+            encode_faces, image_bytes, detection_options(), ingest_options(), quality_options(),
+            callback=finish
+        )
+    except QueueFull:
+        RecognitionJob.query.filter_by(id=job_id).delete()
+        db.session.commit()
+        return jsonify({"error": "Recognition queue is full, try again shortly."}), 503, {"Retry-After": "5"}
+    return jsonify({"job_id": job_id, "status_url": url_for('recognition_job_status', job_id=job_id)}), 202
+
 
 # A command-line function to create all database tables.
 @app.cli.command("create-db")
@@ -61,6 +593,141 @@ def load_faces_command():
     """Command-line command to load known faces."""
     load_known_faces()
 
+
+def run_student_import(source, manifest_text, progress=None):
+    """
+    Bulk-enrolls the students listed in a manifest with photos from `source`,
+    then rebuilds the shared gallery once. Returns import_students' report.
+    """
+    rows = read_manifest(manifest_text)
+    sync_gallery()
+    report = import_students(
+        rows,
+        source,
+        face_matcher,
+        os.path.join(app.root_path, 'static', 'student_photos'),
+        workers=max(app.config['ENCODING_WORKERS'], app.config['IMPORT_WORKERS']),
+        detection_options=detection_options(tiled=False),
+        ingest_options=ingest_options(tiled=False),
+        progress=progress,
+        storage_dtype=app.config['ENCODING_STORAGE_DTYPE']
+    )
+    if report['enrolled']:
+        load_known_faces()
+    return report
+
+
+@app.cli.command("import-students")
+@click.argument('photos', type=click.Path(exists=True))
+@click.option('--manifest', type=click.Path(exists=True, dir_okay=False),
+              help='CSV of students; defaults to students.csv inside PHOTOS.')
+def import_students_command(photos, manifest):
+    """Enroll students in bulk from a directory or ZIP of photos plus a CSV."""
+    def progress(stage, done, total):
+        if total and (done == total or done % 100 == 0):
+            print(f"{stage}: {done}/{total}")
+
+    with app.app_context(), open_photo_source(photos) as source:
+        if manifest:
+            with open(manifest, encoding='utf-8-sig') as f:
+                manifest_text = f.read()
+        else:
+            manifest_text = source.manifest()
+            if manifest_text is None:
+                raise click.ClickException("No students.csv found; pass --manifest.")
+        report = run_student_import(source, manifest_text, progress)
+    for skipped in report['skipped']:
+        print(f"line {skipped['line']} ({skipped['student_id']}): {skipped['reason']}")
+    print(f"Enrolled {report['enrolled']} of {report['total']} students.")
+
+
+@app.cli.command("migrate-encodings")
+@click.option('--dtype', type=click.Choice(sorted(DTYPES)), default=None,
+              help='Storage format; defaults to ENCODING_STORAGE_DTYPE. Converting to a wider type does not restore precision.')
+def migrate_encodings(dtype):
+    """Rewrite stored face encodings in the versioned format and rebuild the gallery."""
+    from models import StudentTemplate
+    dtype = dtype or app.config['ENCODING_STORAGE_DTYPE']
+    with app.app_context():
+        for table, column in ((Student.__table__, 'face_encoding'), (StudentTemplate.__table__, 'encoding')):
+            converted = before = after = 0
+            last_id = 0
+            while True:
+                # Keyset batches, so a large table is never held in memory at once.
+                rows = db.session.execute(
+                    db.select(table.c.id, table.c[column])
+                    .where(table.c.id > last_id, table.c[column].isnot(None))
+                    .order_by(table.c.id)
+                    .limit(1000)
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                updates = []
+                for row_id, data in rows:
+                    name, _, model = describe(data)
+                    if name == dtype and model:
+                        continue
+                    packed = pack(unpack(data, np.float64), dtype)
+                    before += len(data)
+                    after += len(packed)
+                    updates.append({'row_id': row_id, 'data': packed})
+                if updates:
+                    db.session.execute(
+                        table.update().where(table.c.id == db.bindparam('row_id')).values({column: db.bindparam('data')}),
+                        updates
+                    )
+                    db.session.commit()
+                converted += len(updates)
+            print(f"{table.name}: converted {converted} encodings to {dtype}, {before} -> {after} bytes.")
+    load_known_faces()
+
+
+@app.cli.command("close-live-sessions")
+def close_live_sessions_command():
+    """Close live sessions left open past LIVE_SESSION_MAX_AGE and record their absentees."""
+    with app.app_context():
+        closed = close_stale_live_sessions(datetime.datetime.now(), app.config['LIVE_SESSION_MAX_AGE'])
+    print(f"Closed {closed} abandoned live sessions.")
+
+
+@app.cli.command("migrate-indexes")
+def migrate_indexes():
+    """Create the indexes declared on the models that an existing database is missing."""
+    with app.app_context():
+        inspector = db.inspect(db.engine)
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    print(f"Creating {index.name} on {table.name}...")
+                    index.create(db.engine)
+        print("Indexes are up to date.")
+
+
+@app.cli.command("check-query-plans")
+def check_query_plans():
+    """
+    Runs EXPLAIN QUERY PLAN (SQLite) on the attendance hot queries and fails
+    if any reads attendance_record or student in full or sorts in a temp B-tree.
+    """
+    failed = []
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            raise click.ClickException("check-query-plans reads SQLite query plans only.")
+        for name, run in hot_queries():
+            for plan in query_plans(db.engine, run):
+                print(f"{name}:")
+                for detail in plan:
+                    print(f"    {detail}")
+                if plan_problems(plan, HOT_TABLES):
+                    failed.append(name)
+    if failed:
+        raise click.ClickException(f"Full scans or sorts in: {', '.join(failed)}. Run flask migrate-indexes.")
+    print("All attendance queries use indexes.")
+
 # Define a basic route.
 @app.route('/')
 def home():
@@ -88,6 +755,18 @@ def login_required(role=None):
         return decorated_function
     return decorator
 
+# Poll a queued recognition job
+@app.route('/jobs/<job_id>', methods=['GET'])
+@login_required()
+def recognition_job_status(job_id):
+    job = RecognitionJob.query.get(job_id)
+    if not job:
+        return jsonify({"error": "Unknown job"}), 404
+    response = {"job_id": job.id, "kind": job.kind, "status": job.status}
+    if job.result:
+        response.update(json.loads(job.result))
+    return jsonify(response)
+
 # Only admin can enroll students
 @app.route('/enroll', methods=['GET', 'POST'])
 @login_required(role='admin')
@@ -120,38 +799,38 @@ def enroll_student():
 
     try:
         import PIL.Image
-        image = face_recognition.load_image_file(image_file)
-        face_locations_list = face_recognition.face_locations(image)
+        image = load_upload(image_file, tiled=False)
+        face_locations_list = find_faces(image, tiled=False)
         if not face_locations_list:
             return jsonify({"error": "No face found in the image"}), 400
         face_encoding = face_recognition.face_encodings(image, face_locations_list)[0]
 
         # Check for duplicate face encoding (same person already enrolled)
-        if known_face_encodings:
-            matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-            if True in matches:
-                return jsonify({"error": "Student with this face is already enrolled."}), 409
+        sync_gallery()
+        if face_matcher.any_match(face_encoding):
+            return jsonify({"error": "Student with this face is already enrolled."}), 409
 
         # Save the uploaded image to static/student_photos/{student_id}.jpg
         save_dir = os.path.join(app.root_path, 'static', 'student_photos')
         os.makedirs(save_dir, exist_ok=True)
-        image_file.stream.seek(0)
-        img = PIL.Image.open(image_file.stream)
-        img.save(os.path.join(save_dir, f'{student_id}.jpg'))
+        # Saved from the decoded (and upright) pixels rather than decoding again.
+        PIL.Image.fromarray(image).save(os.path.join(save_dir, f'{student_id}.jpg'))
 
         new_student = Student(
             student_id_number=student_id,
             name=f"Student {student_id}",
             username=student_username,
-            face_encoding=face_encoding.tobytes(),
+            face_encoding=pack(face_encoding, app.config['ENCODING_STORAGE_DTYPE']),
             qualification_id=qualification_id
         )
         new_student.set_password(student_password)
         with app.app_context():
             db.session.add(new_student)
             db.session.commit()
-        load_known_faces()
+            update_gallery(student_id, face_encoding, new_student.qualification_id)
         return jsonify({"message": "Student enrolled successfully!", "student_id": student_id}), 201
+    except ImageRejected as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"An error occurred: {e}")
         return jsonify({"error": "An internal error occurred"}), 500
@@ -159,6 +838,7 @@ def enroll_student():
 
 # Mark Attendance route
 @app.route('/attendance', methods=['GET', 'POST'])
+@login_required(role='lecturer')
 def mark_attendance():
     from flask import render_template
     import datetime
@@ -169,21 +849,16 @@ def mark_attendance():
     if 'image' not in request.files:
         return render_template('attendance.html', error="No image uploaded")
     image_file = request.files['image']
+    if request.form.get('async'):
+        # Return a job ID straight away; the client polls /jobs/<id>
+        return queue_recognition('attendance', image_file.read())
     try:
-        image = face_recognition.load_image_file(image_file)
-        face_locations = face_recognition.face_locations(image)
-        face_encodings = face_recognition.face_encodings(image, face_locations)
+        face_locations, face_encodings, rejected = encode_upload(image_file.read())
         if not face_encodings:
             # Redirect to results page with a special flag for no faces detected
             from flask import redirect, url_for
             return redirect(url_for('attendance_results', students='', no_faces='1'))
-        matched_students = set()
-        for encoding in face_encodings:
-            matches = face_recognition.compare_faces(known_face_encodings, encoding, tolerance=0.5)
-            for idx, is_match in enumerate(matches):
-                if is_match:
-                    matched_students.add(known_student_ids[idx])
-        matched_students = list(matched_students)
+        matched_students = match_faces(face_encodings)
         from flask import redirect, url_for
         if matched_students:
             ids_str = ','.join(matched_students)
@@ -191,6 +866,8 @@ def mark_attendance():
         else:
             # Faces detected, but no students matched
             return redirect(url_for('attendance_results', students='', no_students='1'))
+    except ImageRejected as e:
+        return render_template('attendance.html', error=str(e))
     except Exception as e:
         print(f"Attendance error: {e}")
         return render_template('attendance.html', error="An internal error occurred")
@@ -198,8 +875,94 @@ def mark_attendance():
 
 
 
+# Prometheus metrics: recognition stage histograms and pipeline gauges for this worker
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return "Unauthorized\n", 401
+    cache = encoding_cache.stats()
+    body = pipeline_metrics.prometheus({
+        'encoding_cache_hits_total': ('counter', 'Uploads served from the encoding cache.', cache['hits']),
+        'encoding_cache_misses_total': ('counter', 'Uploads that had to be decoded and encoded.', cache['misses']),
+        'encoding_cache_entries': ('gauge', 'Photos held in the in-memory encoding cache.', cache['entries']),
+        'recognition_jobs_pending': ('gauge', 'Queued or running background recognition jobs.', recognition_jobs.pending),
+        'gallery_encodings': ('gauge', 'Face encodings in the loaded gallery.', len(face_matcher)),
+    })
+    return app.response_class(body, mimetype='text/plain; version=0.0.4')
+
+
+# Per-stage p50/p95/p99 of the recognition routes, as JSON
+@app.route('/admin/timings', methods=['GET'])
+@login_required(role='admin')
+def pipeline_timings():
+    return jsonify(pipeline_metrics.summary())
+
+
+# Hit/miss counters of the uploaded-photo encoding cache
+@app.route('/admin/encoding-cache', methods=['GET'])
+@login_required(role='admin')
+def encoding_cache_stats():
+    return jsonify(encoding_cache.stats())
+
+
+# Bulk enrollment: a ZIP of photos with a students.csv (or a separate CSV)
+@app.route('/enroll/bulk', methods=['GET', 'POST'])
+@login_required(role='admin')
+def bulk_enroll():
+    if request.method == 'GET':
+        return render_template('bulk_enroll.html', current_year=datetime.datetime.now().year)
+    archive = request.files.get('archive')
+    if not archive:
+        return jsonify({"error": "Upload a ZIP archive of photos."}), 400
+    import_dir = os.path.join(app.instance_path, 'imports')
+    os.makedirs(import_dir, exist_ok=True)
+    job_id = uuid.uuid4().hex
+    archive_path = os.path.join(import_dir, f'{job_id}.zip')
+    archive.save(archive_path)
+    manifest_file = request.files.get('manifest')
+    manifest_text = manifest_file.read().decode('utf-8-sig') if manifest_file else None
+    db.session.add(RecognitionJob(id=job_id, kind='enrollment', status='queued'))
+    db.session.commit()
+
+    def run():
+        with app.app_context():
+            job = RecognitionJob.query.get(job_id)
+            last_update = [0.0]
+
+            def progress(stage, done, total):
+                # Progress is what /jobs/<id> shows while the import runs; write it at most once a second.
+                if done != total and time.monotonic() - last_update[0] < 1.0:
+                    return
+                last_update[0] = time.monotonic()
+                job.result = json.dumps({"stage": stage, "done": done, "total": total})
+                db.session.commit()
+
+            try:
+                with open_photo_source(archive_path) as source:
+                    text = manifest_text if manifest_text is not None else source.manifest()
+                    if text is None:
+                        raise ValueError("No students.csv in the archive and no CSV uploaded.")
+                    report = run_student_import(source, text, progress)
+                job.result = json.dumps(report)
+                job.status = 'done'
+            except Exception as e:
+                print(f"Bulk enrollment error: {e}")
+                db.session.rollback()
+                job = RecognitionJob.query.get(job_id)
+                job.result = json.dumps({"error": str(e) if isinstance(e, ValueError) else "An internal error occurred"})
+                job.status = 'failed'
+            job.finished_at = datetime.datetime.utcnow()
+            db.session.commit()
+            os.remove(archive_path)
+
+    threading.Thread(target=run, daemon=True).start()
+    return jsonify({"job_id": job_id, "status_url": url_for('recognition_job_status', job_id=job_id)}), 202
+
+
 # Edit student route
 @app.route('/students/<student_id>/edit', methods=['GET', 'POST'])
+@login_required(role='admin')
 def edit_student(student_id):
     from flask import render_template, request, redirect, url_for
     import datetime
@@ -209,13 +972,46 @@ def edit_student(student_id):
             return "Student not found", 404
         if request.method == 'POST':
             student.name = request.form['name']
+            if request.files.get('photo'):
+                error = add_student_photo(student, request.files['photo'])
+                if error:
+                    db.session.rollback()
+                    current_year = datetime.datetime.now().year
+                    return render_template('edit_student.html', student=student, error=error, current_year=current_year)
             db.session.commit()
+            if request.files.get('photo'):
+                update_gallery(
+                    student.student_id_number, unpack(student.face_encoding, face_matcher.dtype),
+                    student.qualification_id, student_templates(student)
+                )
             return redirect(url_for('view_students'))
     current_year = datetime.datetime.now().year
     return render_template('edit_student.html', student=student, current_year=current_year)
 
+
+def add_student_photo(student, image_file):
+    """
+    Adds the face in another photo of a student as one of their templates.
+    Returns an error message if the photo has no face or does not look like
+    the student; the caller commits and updates the gallery.
+    """
+    try:
+        image = load_upload(image_file, tiled=False)
+    except ImageRejected as e:
+        return str(e)
+    face_locations, _ = usable_faces(image, find_faces(image, tiled=False))
+    if not face_locations:
+        return "No usable face found in the photo."
+    encoding = face_recognition.face_encodings(image, face_locations[:1])[0]
+    # The same tolerance enrollment uses to spot an already-enrolled face.
+    if nearest_template(student, encoding) > 0.6:
+        return "The face in the photo does not match this student."
+    add_template(student, encoding, 'photo', app.config['FACE_TEMPLATES_MAX'], app.config['ENCODING_STORAGE_DTYPE'])
+    return None
+
 # Delete student route
 @app.route('/students/<student_id>/delete', methods=['POST'])
+@login_required(role='admin')
 def delete_student(student_id):
     from flask import redirect, url_for
     with app.app_context():
@@ -227,7 +1023,7 @@ def delete_student(student_id):
             photo_path = os.path.join(app.root_path, 'static', 'student_photos', f'{student_id}.jpg')
             if os.path.exists(photo_path):
                 os.remove(photo_path)
-        load_known_faces()
+            update_gallery(student_id)
     return redirect(url_for('view_students'))
 
 
@@ -238,6 +1034,7 @@ def delete_student(student_id):
 from sqlalchemy.orm import joinedload
 
 @app.route('/students', methods=['GET'])
+@login_required(role='admin')
 def view_students():
     from flask import render_template
     import datetime
@@ -277,52 +1074,42 @@ def mark_register():
             sid = key.split('_')[1]
             marks_dict[sid] = int(request.form[key])
 
-    image_file = None
-    if 'image' in request.files:
-        image_file = request.files['image']
-    elif 'camera_image' in request.form and request.form['camera_image']:
-        import base64, io, PIL.Image
-        data_url = request.form['camera_image']
-        header, encoded = data_url.split(',', 1)
-        img_bytes = base64.b64decode(encoded)
-        image_file = io.BytesIO(img_bytes)
+    image_file = uploaded_image(request.form)
+
+    if image_file and request.form.get('async'):
+        # Records are written by the job once the photo has been recognised
+        def save_register(present_student_ids):
+            record_attendance(qualification_id, module_id, attendance_time, present_student_ids, marks_dict)
+            return {
+                "module_id": module_id,
+                "qualification_id": qualification_id,
+                "attendance_time": attendance_time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+        return queue_recognition('register', image_file.read(), qualification_id, save_register)
 
     present_student_ids = []
     students = []
+    rejected = []
     if image_file:
         try:
-            import PIL.Image
-            image = face_recognition.load_image_file(image_file)
-            face_locations = face_recognition.face_locations(image)
-            face_encodings = face_recognition.face_encodings(image, face_locations)
+            face_locations, face_encodings, rejected = encode_upload(image_file.read())
             if face_encodings:
-                matched_students = set()
-                for encoding in face_encodings:
-                    matches = face_recognition.compare_faces(known_face_encodings, encoding, tolerance=0.5)
-                    for idx, is_match in enumerate(matches):
-                        if is_match:
-                            matched_students.add(known_student_ids[idx])
-                present_student_ids = list(matched_students)
+                present_student_ids = match_faces(face_encodings, qualification_id)
+        except ImageRejected as e:
+            # Nothing is recorded for a photo that could not be read
+            return render_template(
+                'mark_register.html',
+                qualifications=qualifications,
+                modules=modules,
+                current_year=datetime.datetime.now().year,
+                error=str(e)
+            ), 400
         except Exception as e:
             print(f"Mark register error: {e}")
 
-    # Get all students for this qualification
-    all_students = Student.query.filter_by(qualification_id=qualification_id).all()
-
     # Save attendance records for all students in the qualification
-    for student in all_students:
-        status = "Present" if student.student_id_number in present_student_ids else "Absent"
-        marks = marks_dict.get(student.student_id_number, 0) if status == "Present" else 0
-        record = AttendanceRecord(
-            student_id=student.id,
-            module_id=module_id,
-            qualification_id=qualification_id,
-            date_time=attendance_time,
-            marks=marks,
-            status=status
-        )
-        db.session.add(record)
-    db.session.commit()
+    with timed('record'):
+        record_attendance(qualification_id, module_id, attendance_time, present_student_ids, marks_dict)
 
     # Prepare students for results template (only present students)
     students = Student.query.filter(Student.student_id_number.in_(present_student_ids)).all() if present_student_ids else []
@@ -335,11 +1122,34 @@ def mark_register():
         qualification_id=qualification_id,
         lecturer_name=session.get('user', 'Unknown'),
         attendance_time=attendance_time.strftime('%Y-%m-%d %H:%M:%S'),
+        rejected_faces=len(rejected),
         current_year=current_year
     )
 
 
 
+# Results of a register whose photo was recognised in the background
+@app.route('/mark-register/results/<job_id>', methods=['GET'])
+@login_required(role='lecturer')
+def register_job_results(job_id):
+    job = RecognitionJob.query.get(job_id)
+    if not job or job.kind != 'register' or job.status != 'done':
+        return redirect(url_for('mark_register'))
+    result = json.loads(job.result)
+    present_student_ids = result['student_ids']
+    students = Student.query.filter(Student.student_id_number.in_(present_student_ids)).all() if present_student_ids else []
+    return render_template(
+        'mark_register_results.html',
+        students=students,
+        module_id=result['module_id'],
+        qualification_id=result['qualification_id'],
+        lecturer_name=session.get('user', 'Unknown'),
+        attendance_time=result['attendance_time'],
+        rejected_faces=len(result['rejected']),
+        current_year=datetime.datetime.now().year
+    )
+
+
 # Export register as PDF
 @app.route('/export-register', methods=['POST'])
 @login_required(role='lecturer')
@@ -424,7 +1234,6 @@ def list_registers():
 @login_required(role='lecturer')
 def award_marks():
     from flask import request, redirect, url_for, flash
-    from models import Student, AttendanceRecord, db
 
     module_id = request.form.get('module_id')
     qualification_id = request.form.get('qualification_id')
@@ -432,21 +1241,8 @@ def award_marks():
     marks = int(request.form.get('marks', 0))
     attendance_time = datetime.datetime.now()
 
-    # Get all students for this qualification
-    all_students = Student.query.filter_by(qualification_id=qualification_id).all()
-
-    for student in all_students:
-        is_present = student.student_id_number in student_ids
-        record = AttendanceRecord(
-            student_id=student.id,
-            module_id=module_id,
-            qualification_id=qualification_id,
-            date_time=attendance_time,
-            marks=marks if is_present else 0,
-            status="Present" if is_present else "Absent"
-        )
-        db.session.add(record)
-    db.session.commit()
+    # Save attendance records for all students in the qualification
+    record_attendance(qualification_id, module_id, attendance_time, student_ids, marks)
 
     flash("Marks awarded and attendance records created.")
     return redirect(url_for('mark_register'))
@@ -454,67 +1250,116 @@ def award_marks():
 
 
 
+def scan_live_frame(live_session, image_file, seq=None):
+    """
+    Recognises the faces in one live camera frame and records students seen
+    for the first time in the session. Returns (faces_found, present_pks,
+    rejected), present_pks covering everyone present so far and rejected
+    the faces the quality gate kept out of encoding. Raises FrameDropped instead
+    when another frame of the session is still being processed, or when
+    `seq` is not newer than the last frame taken.
+    """
+    pacer = live_pacers.get(live_session.id)
+    reason = pacer.begin(seq)
+    if reason:
+        raise FrameDropped(reason)
+    started = time.monotonic()
+    try:
+        return recognise_live_frame(live_session, image_file)
+    finally:
+        pacer.finish(time.monotonic() - started)
+
+
+def recognise_live_frame(live_session, image_file):
+    with timed('decode'):
+        image = load_upload(image_file)
+    with timed('detect'):
+        face_locations = find_faces(image)
+    # Faces already confirmed on an earlier frame keep their student
+    # without being encoded again; only new or unconfirmed ones are.
+    tracker = live_trackers.get(live_session.id)
+    to_encode, present_student_ids = tracker.update(face_locations)
+    rejected = []
+    if to_encode:
+        with timed('quality'):
+            kept, rejected = assess_faces(image, [face_locations[i] for i in to_encode], **quality_options())
+        # Rejected faces stay unconfirmed in the tracker and are assessed again on the next frame.
+        matches = [(None, None)] * len(to_encode)
+        if kept:
+            with timed('encode'):
+                face_encodings = compute_encodings(image, [face_locations[to_encode[k]] for k in kept])
+            identified = identify_faces(face_encodings, live_session.qualification_id)
+            learn_templates(face_encodings, identified)
+            for k, match in zip(kept, identified):
+                matches[k] = match
+        tracker.resolve(matches)
+        present_student_ids.extend(sid for sid, _ in matches if sid is not None)
+    # Only students seen for the first time in this session get a new row
+    with timed('record'):
+        present_pks = record_live_scan(live_session, present_student_ids)
+    return len(face_locations), present_pks, rejected
+
+
+def live_frame_headers(live_session):
+    return {"X-Next-Interval": str(live_pacers.get(live_session.id).next_interval())}
+
+
+def frame_dropped_response(live_session, reason):
+    """429 telling the client its frame was skipped and when to send the next one."""
+    next_interval = live_pacers.get(live_session.id).next_interval()
+    return (
+        jsonify({"dropped": reason, "next_interval": next_interval}),
+        429,
+        {"Retry-After": str(int(math.ceil(next_interval))), "X-Next-Interval": str(next_interval)}
+    )
+
+
+def lecturer_live_session(session_id):
+    """The signed-in lecturer's live session with this id, or None."""
+    from models import LiveSession
+    live_session = LiveSession.query.get(session_id)
+    if live_session is None or live_session.lecturer_username != session.get('user', 'Unknown'):
+        return None
+    return live_session
+
+
 # Live Camera Attendance route
 @app.route('/live-attendance', methods=['GET', 'POST'])
 @login_required(role='lecturer')
 def live_attendance():
     from flask import render_template, request, session, redirect, url_for, jsonify
-    import base64, io, datetime
-    from models import Student, AttendanceRecord, Qualification, Module, db
+    import datetime
+    from models import Student, Qualification, Module
 
     if request.method == 'GET':
+        # Opening the page settles lectures that were left running without a stop.
+        close_stale_live_sessions(datetime.datetime.now(), app.config['LIVE_SESSION_MAX_AGE'])
         current_year = datetime.datetime.now().year
         qualifications = Qualification.query.all()
         modules = Module.query.all()
         return render_template('live_attendance.html', current_year=current_year, qualifications=qualifications, modules=modules)
 
-    # POST: process camera image, qualification, and module
-    data = request.get_json()
-    if not data or 'camera_image' not in data or 'qualification_id' not in data or 'module_id' not in data:
+    # POST: process camera frame, qualification, and module. The frame is sent
+    # as a binary JPEG body or multipart part; JSON with a data URL still works.
+    data = request.get_json() if request.is_json else request.values
+    image_file = uploaded_image(data) if data else None
+    if not image_file or 'qualification_id' not in data or 'module_id' not in data:
         return jsonify({"error": "Missing required data."}), 400
 
-    data_url = data['camera_image']
     qualification_id = data['qualification_id']
     module_id = data['module_id']
     lecturer_name = session.get('user', 'Unknown')
-    attendance_time = datetime.datetime.now()
+    # Every scan of a lecture belongs to one live session and shares its timestamp.
+    live_session = open_live_session(
+        lecturer_name, module_id, qualification_id, datetime.datetime.now(), app.config['LIVE_SESSION_MAX_AGE']
+    )
+    attendance_time = live_session.started_at
     students = []
-    present_student_ids = []
 
     try:
-        header, encoded = data_url.split(',', 1)
-        img_bytes = base64.b64decode(encoded)
-        image_file = io.BytesIO(img_bytes)
-        import PIL.Image
-        image = face_recognition.load_image_file(image_file)
-        face_locations = face_recognition.face_locations(image)
-        face_encodings = face_recognition.face_encodings(image, face_locations)
-        if face_encodings:
-            matched_students = set()
-            for encoding in face_encodings:
-                matches = face_recognition.compare_faces(known_face_encodings, encoding, tolerance=0.5)
-                for idx, is_match in enumerate(matches):
-                    if is_match:
-                        matched_students.add(known_student_ids[idx])
-            present_student_ids = list(matched_students)
-        # Get all students for this qualification
-        all_students = Student.query.filter_by(qualification_id=qualification_id).all()
-        # Save attendance records for all students in the qualification
-        for student in all_students:
-            status = "Present" if student.student_id_number in present_student_ids else "Absent"
-            marks = 1 if status == "Present" else 0  # You can adjust marks logic as needed
-            record = AttendanceRecord(
-                student_id=student.id,
-                module_id=module_id,
-                qualification_id=qualification_id,
-                date_time=attendance_time,
-                marks=marks,
-                status=status
-            )
-            db.session.add(record)
-        db.session.commit()
-        # Prepare students for template (only present students)
-        students = Student.query.filter(Student.student_id_number.in_(present_student_ids)).all() if present_student_ids else []
+        faces, present_pks, rejected = scan_live_frame(live_session, image_file, request.args.get('seq', type=int))
+        # Prepare students for template (everyone present so far this session)
+        students = Student.query.filter(Student.id.in_(present_pks)).all() if present_pks else []
         current_year = datetime.datetime.now().year
         return render_template(
             'live_register_results.html',
@@ -523,8 +1368,13 @@ def live_attendance():
             qualification_id=qualification_id,
             lecturer_name=lecturer_name,
             attendance_time=attendance_time.strftime('%Y-%m-%d %H:%M:%S'),
+            rejected_faces=len(rejected),
             current_year=current_year
-        )
+        ), live_frame_headers(live_session)
+    except FrameDropped as e:
+        return frame_dropped_response(live_session, e.args[0])
+    except ImageRejected as e:
+        return jsonify({"error": str(e)}), 400, live_frame_headers(live_session)
     except Exception as e:
         print(f"Live attendance error: {e}")
         current_year = datetime.datetime.now().year
@@ -536,7 +1386,148 @@ def live_attendance():
             lecturer_name=lecturer_name,
             attendance_time=attendance_time.strftime('%Y-%m-%d %H:%M:%S'),
             current_year=current_year
-        )
+        ), live_frame_headers(live_session)
+
+
+# Start a live attendance session
+@app.route('/live-attendance/start', methods=['POST'])
+@login_required(role='lecturer')
+def start_live_attendance():
+    data = request.get_json()
+    if not data or 'qualification_id' not in data or 'module_id' not in data:
+        return jsonify({"error": "Missing required data."}), 400
+    # Starting always begins a new lecture; a session left open is closed first.
+    live_session = open_live_session(
+        session.get('user', 'Unknown'), data['module_id'], data['qualification_id'], datetime.datetime.now(),
+        fresh=True
+    )
+    # A reloaded page numbers its frames from 1 again, so no earlier frame
+    # sequence or face tracks may carry over into the new session.
+    live_trackers.discard(live_session.id)
+    live_pacers.discard(live_session.id)
+    return jsonify({
+        "session_id": live_session.id,
+        "started_at": live_session.started_at.strftime('%Y-%m-%d %H:%M:%S')
+    })
+
+
+# Stop a live attendance session and record everyone not seen as absent
+@app.route('/live-attendance/stop', methods=['POST'])
+@login_required(role='lecturer')
+def stop_live_attendance():
+    from models import LiveSession
+    data = request.get_json()
+    if not data or 'qualification_id' not in data or 'module_id' not in data:
+        return jsonify({"error": "Missing required data."}), 400
+    live_session = LiveSession.query.filter_by(
+        lecturer_username=session.get('user', 'Unknown'),
+        module_id=data['module_id'],
+        qualification_id=data['qualification_id'],
+        ended_at=None
+    ).first()
+    if not live_session:
+        return jsonify({"error": "No live session in progress."}), 404
+    present, absent = close_live_session(live_session, datetime.datetime.now())
+    live_trackers.discard(live_session.id)
+    live_pacers.discard(live_session.id)
+    return jsonify({"session_id": live_session.id, "present": present, "absent": absent})
+
+
+# Push one frame of a streamed live session; results arrive on the event stream
+@app.route('/live-attendance/<int:session_id>/frames', methods=['POST'])
+@login_required(role='lecturer')
+def push_live_frame(session_id):
+    live_session = lecturer_live_session(session_id)
+    if not live_session:
+        return jsonify({"error": "Unknown live session."}), 404
+    if live_session.ended_at is not None:
+        return jsonify({"error": "Live session has ended."}), 409
+    image_file = uploaded_image(request.values)
+    if not image_file:
+        return jsonify({"error": "Missing camera frame."}), 400
+    try:
+        faces, present_pks, rejected = scan_live_frame(live_session, image_file, request.args.get('seq', type=int))
+    except FrameDropped as e:
+        return frame_dropped_response(live_session, e.args[0])
+    except ImageRejected as e:
+        return jsonify({"error": str(e)}), 400, live_frame_headers(live_session)
+    except Exception as e:
+        print(f"Live frame error: {e}")
+        return jsonify({"error": "Could not process frame."}), 422, live_frame_headers(live_session)
+    headers = live_frame_headers(live_session)
+    return jsonify({
+        "faces": faces,
+        "rejected": rejected,
+        "present": len(present_pks),
+        "next_interval": float(headers["X-Next-Interval"])
+    }), headers
+
+
+# Server-sent events: students as they are first recognised in a live session
+@app.route('/live-attendance/<int:session_id>/events', methods=['GET'])
+@login_required(role='lecturer')
+def live_attendance_events(session_id):
+    from models import LiveSession
+    if not lecturer_live_session(session_id):
+        return jsonify({"error": "Unknown live session."}), 404
+    if not live_streams.acquire(blocking=False):
+        return jsonify({"error": "Too many live event streams, use per-frame results."}), 503
+    # EventSource sends back the id of the last event it saw when it reconnects.
+    last_record_id = request.headers.get('Last-Event-ID', type=int) or 0
+    poll = app.config['LIVE_EVENTS_POLL_SECONDS']
+    deadline = time.monotonic() + app.config['LIVE_EVENTS_STREAM_SECONDS']
+
+    def stream(last_record_id):
+        yield "retry: 1000\n\n"
+        while True:
+            # A fresh context per poll, so each query sees rows committed by other workers.
+            with app.app_context():
+                live_session = LiveSession.query.get(session_id)
+                arrivals = live_session_arrivals(live_session, last_record_id)
+                ended = live_session.ended_at is not None
+            if arrivals:
+                last_record_id = arrivals[-1][0]
+                students = [{"student_id": sid, "name": name} for _, sid, name in arrivals]
+                yield f"id: {last_record_id}\nevent: present\ndata: {json.dumps({'students': students})}\n\n"
+            if ended:
+                yield "event: closed\ndata: {}\n\n"
+                return
+            if time.monotonic() >= deadline:
+                return
+            # Comment line; also lets the server notice a closed connection.
+            yield ": keep-alive\n\n"
+            time.sleep(poll)
+
+    response = app.response_class(
+        stream(last_record_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Runs when the server closes the response, even if the stream never started.
+    response.call_on_close(live_streams.release)
+    return response
+
+
+# Results page for a streamed live session (everyone present so far)
+@app.route('/live-attendance/<int:session_id>/results', methods=['GET'])
+@login_required(role='lecturer')
+def live_attendance_results(session_id):
+    live_session = lecturer_live_session(session_id)
+    if not live_session:
+        return redirect(url_for('live_attendance'))
+    students = [
+        {"student_id_number": sid, "name": name}
+        for _, sid, name in live_session_arrivals(live_session)
+    ]
+    return render_template(
+        'live_register_results.html',
+        students=students,
+        module_id=live_session.module_id,
+        qualification_id=live_session.qualification_id,
+        lecturer_name=live_session.lecturer_username,
+        attendance_time=live_session.started_at.strftime('%Y-%m-%d %H:%M:%S'),
+        current_year=datetime.datetime.now().year
+    )
 
 app.secret_key = 'supersecretkey'  # Change for production
 # Helper: login required decorator
@@ -561,7 +1552,7 @@ with app.app_context():
         admin.set_password('admin123')
         db.session.add(admin)
         db.session.commit()
-    load_known_faces()
+    sync_gallery()
 
 # Login route
 
@@ -685,7 +1676,6 @@ def student_login():
 def student_dashboard():
     from flask import render_template, session, redirect, url_for
     import datetime
-    from sqlalchemy.orm import joinedload
 
     current_year = datetime.datetime.now().year
     student_id = session.get('student_id')
@@ -693,9 +1683,7 @@ def student_dashboard():
         return redirect(url_for('student_login'))
     with app.app_context():
         student = Student.query.filter_by(student_id_number=student_id).first()
-        attendance_records = AttendanceRecord.query.options(
-            joinedload(AttendanceRecord.module)
-        ).filter_by(student_id=student.id).order_by(AttendanceRecord.date_time.desc()).all()
+        attendance_records = student_attendance(student.id).all()
     return render_template(
         'student_dashboard.html',
         student=student,
@@ -749,10 +1737,7 @@ def manage_modules():
 @login_required(role='student')
 def attendance_records():
     student_id = session.get('user_id')
-    records = AttendanceRecord.query.options(
-        joinedload(AttendanceRecord.module),
-        joinedload(AttendanceRecord.qualification)
-    ).filter_by(student_id=student_id).order_by(AttendanceRecord.date_time.desc()).all()
+    records = student_attendance(student_id).all()
     return render_template('attendance_records.html', records=records)
 
 
@@ -800,7 +1785,7 @@ def initialize_app():
             admin.set_password('admin123')
             db.session.add(admin)
             db.session.commit()
-        load_known_faces()
+        sync_gallery()
 
 initialize_app()
 
@@ -0,0 +1,179 @@
+from sqlalchemy.orm import joinedload
+
+from models import db, Student, AttendanceRecord, LiveSession
+
+
+def cohort_students(qualification_id):
+    """(id, student_id_number) of every student in a qualification, without loading ORM objects."""
+    return db.session.query(Student.id, Student.student_id_number).filter_by(
+        qualification_id=qualification_id
+    ).all()
+
+
+def student_attendance(student_pk):
+    """Query for a student's attendance records, newest first, with module and qualification loaded."""
+    return AttendanceRecord.query.options(
+        joinedload(AttendanceRecord.module),
+        joinedload(AttendanceRecord.qualification)
+    ).filter_by(student_id=student_pk).order_by(AttendanceRecord.date_time.desc())
+
+
+def attendance_rows(students, module_id, qualification_id, attendance_time, present_student_ids, marks=0):
+    """
+    Builds one AttendanceRecord row dict per student. `marks` is awarded to
+    present students and is either a single value or a dict of
+    student_id_number -> marks; absent students always get 0.
+    """
+    present = set(present_student_ids)
+    rows = []
+    for student_pk, student_id_number in students:
+        is_present = student_id_number in present
+        if not is_present:
+            awarded = 0
+        elif isinstance(marks, dict):
+            awarded = marks.get(student_id_number, 0)
+        else:
+            awarded = marks
+        rows.append({
+            'student_id': student_pk,
+            'module_id': module_id,
+            'qualification_id': qualification_id,
+            'date_time': attendance_time,
+            'marks': awarded,
+            'status': "Present" if is_present else "Absent",
+        })
+    return rows
+
+
+def record_attendance(qualification_id, module_id, attendance_time, present_student_ids, marks=0):
+    """
+    Saves a Present/Absent record for every student in the qualification with
+    a single executemany INSERT instead of one ORM object per student, and
+    commits. Returns the number of rows written.
+    """
+    rows = attendance_rows(
+        cohort_students(qualification_id), module_id, qualification_id,
+        attendance_time, present_student_ids, marks
+    )
+    if rows:
+        db.session.execute(AttendanceRecord.__table__.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def open_live_session(lecturer_username, module_id, qualification_id, now, max_age=None, fresh=False):
+    """
+    Returns the lecturer's open session for this module and qualification,
+    starting one if needed. An open session that was never stopped (closed
+    tab, lost network) is closed, writing its Absent rows, and replaced by a
+    new one when `fresh` is set or it started more than `max_age` (a
+    timedelta) ago, so a later lecture never resumes it.
+    """
+    live_session = LiveSession.query.filter_by(
+        lecturer_username=lecturer_username,
+        module_id=module_id,
+        qualification_id=qualification_id,
+        ended_at=None
+    ).first()
+    if live_session is not None and (fresh or (max_age is not None and now - live_session.started_at > max_age)):
+        close_live_session(live_session, now)
+        live_session = None
+    if live_session is None:
+        live_session = LiveSession(
+            lecturer_username=lecturer_username,
+            module_id=module_id,
+            qualification_id=qualification_id,
+            started_at=now
+        )
+        db.session.add(live_session)
+        db.session.commit()
+    return live_session
+
+
+def live_session_present(live_session):
+    """Primary keys of the students already marked present in a live session."""
+    return {
+        student_pk for (student_pk,) in db.session.query(AttendanceRecord.student_id).filter_by(
+            module_id=live_session.module_id,
+            qualification_id=live_session.qualification_id,
+            date_time=live_session.started_at,
+            status="Present"
+        )
+    }
+
+
+def live_session_arrivals(live_session, after_record_id=0):
+    """
+    (record id, student_id_number, name) of the Present rows written in a live
+    session after the given record id, oldest first. Record ids only grow, so
+    the last one seen works as a resume point for streamed updates.
+    """
+    return db.session.query(AttendanceRecord.id, Student.student_id_number, Student.name).join(
+        Student, AttendanceRecord.student_id == Student.id
+    ).filter(
+        AttendanceRecord.module_id == live_session.module_id,
+        AttendanceRecord.qualification_id == live_session.qualification_id,
+        AttendanceRecord.date_time == live_session.started_at,
+        AttendanceRecord.status == "Present",
+        AttendanceRecord.id > after_record_id
+    ).order_by(AttendanceRecord.id).all()
+
+
+def record_live_scan(live_session, present_student_ids):
+    """
+    Adds Present rows for cohort students seen for the first time in this
+    session; students already recorded are left untouched. Returns the
+    primary keys of every student present so far.
+    """
+    seen = live_session_present(live_session)
+    present = set(present_student_ids)
+    newly_seen = [
+        (student_pk, student_id_number)
+        for student_pk, student_id_number in cohort_students(live_session.qualification_id)
+        if student_pk not in seen and student_id_number in present
+    ]
+    if newly_seen:
+        rows = attendance_rows(
+            newly_seen, live_session.module_id, live_session.qualification_id,
+            live_session.started_at, present, marks=1
+        )
+        db.session.execute(AttendanceRecord.__table__.insert(), rows)
+        db.session.commit()
+    return seen | {student_pk for student_pk, _ in newly_seen}
+
+
+def close_live_session(live_session, now):
+    """
+    Writes Absent rows for every cohort student never seen during the
+    session and marks it ended. Returns (present_count, absent_count).
+    """
+    seen = live_session_present(live_session)
+    absent = [
+        (student_pk, student_id_number)
+        for student_pk, student_id_number in cohort_students(live_session.qualification_id)
+        if student_pk not in seen
+    ]
+    if absent:
+        rows = attendance_rows(
+            absent, live_session.module_id, live_session.qualification_id,
+            live_session.started_at, []
+        )
+        db.session.execute(AttendanceRecord.__table__.insert(), rows)
+    live_session.ended_at = now
+    db.session.commit()
+    return len(seen), len(absent)
+
+
+def close_stale_live_sessions(now, max_age):
+    """
+    Closes every session still open more than `max_age` (a timedelta) after
+    it started, writing its Absent rows, for lectures whose page was closed
+    without stopping and never resumed. Returns how many were closed.
+    """
+    stale = LiveSession.query.filter(
+        LiveSession.ended_at.is_(None),
+        LiveSession.started_at < now - max_age
+    ).all()
+    for live_session in stale:
+        close_live_session(live_session, now)
+    return len(stale)
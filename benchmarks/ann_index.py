@@ -0,0 +1,65 @@
+"""
+Recall and latency of the IVF index against the brute-force matcher.
+
+    python -m benchmarks.ann_index [--sizes 1000 10000 100000] [--nprobe 8]
+
+Each query batch stands in for one 60-face lecture hall photo. Recall is the
+fraction of faces whose nearest student from the index equals the exact
+nearest student.
+"""
+import argparse
+import time
+
+from ann_index import IVFIndex
+from benchmarks.synthetic import make_gallery, make_queries
+from face_matcher import FaceMatcher
+
+
+def _time_batches(matcher, batches):
+    start = time.perf_counter()
+    results = [matcher.best_matches(batch) for batch in batches]
+    return (time.perf_counter() - start) / len(batches), results
+
+
+def run(size, nprobe, faces=60, photos=20):
+    gallery = make_gallery(size)
+    student_ids = [str(i) for i in range(size)]
+    batches = [make_queries(gallery, faces, seed=seed)[0] for seed in range(photos)]
+
+    brute = FaceMatcher(gallery, student_ids)
+    approx = FaceMatcher(gallery, student_ids, index=IVFIndex(nprobe=nprobe), index_min_size=0)
+    start = time.perf_counter()
+    approx.best_matches(batches[0])  # trains and fills the index
+    build = time.perf_counter() - start
+
+    brute_latency, exact = _time_batches(brute, batches)
+    ann_latency, found = _time_batches(approx, batches)
+    hits = sum(
+        a[0] == e[0]
+        for exact_batch, found_batch in zip(exact, found)
+        for a, e in zip(found_batch, exact_batch)
+    )
+    return {
+        'gallery': size,
+        'nprobe': nprobe,
+        'build_s': round(build, 3),
+        'brute_ms_per_photo': round(brute_latency * 1000, 2),
+        'ann_ms_per_photo': round(ann_latency * 1000, 2),
+        'recall_at_1': round(hits / (faces * photos), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--nprobe', type=int, default=8)
+    args = parser.parse_args()
+    columns = ['gallery', 'nprobe', 'build_s', 'brute_ms_per_photo', 'ann_ms_per_photo', 'recall_at_1']
+    print('  '.join(f'{c:>18}' for c in columns))
+    for size in args.sizes:
+        row = run(size, args.nprobe)
+        print('  '.join(f'{row[c]:>18}' for c in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Detection latency and recall at several downscale sizes.
+
+    python -m benchmarks.detection_scales [--faces 60] [--cell 480] [--sizes 640 1024 1600 2400]
+
+Full-resolution HOG detection on the collage is the reference; a face
+counts as found at a given size when one of the remapped boxes overlaps a
+reference box with IoU >= 0.5.
+"""
+import argparse
+import time
+
+from benchmarks.images import make_collage
+from face_detection import detect_faces
+
+
+def iou(a, b):
+    top, right, bottom, left = max(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area = lambda box: (box[1] - box[3]) * (box[2] - box[0])
+    return inter / float(area(a) + area(b) - inter) if inter else 0.0
+
+
+def timed(image, max_side, pyramid=False):
+    start = time.perf_counter()
+    boxes = detect_faces(image, max_side=max_side, pyramid=pyramid)
+    return boxes, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--faces', type=int, default=60)
+    parser.add_argument('--cell', type=int, default=480)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[640, 1024, 1600, 2400])
+    args = parser.parse_args()
+
+    image = make_collage(args.faces, args.cell)
+    reference, full_time = timed(image, 0)
+    print(f'{image.shape[1]}x{image.shape[0]} collage, {len(reference)} faces at full resolution')
+    print(f'{"max side":>9}  {"ms":>8}  {"speedup":>8}  {"recall":>7}')
+    print(f'{"full":>9}  {full_time * 1000:8.1f}  {1.0:>7.1f}x  {1.0:7.3f}')
+    for size in args.sizes:
+        boxes, elapsed = timed(image, size)
+        found = sum(any(iou(ref, box) >= 0.5 for box in boxes) for ref in reference)
+        recall = found / len(reference) if reference else 1.0
+        print(f'{size:>9}  {elapsed * 1000:8.1f}  {full_time / elapsed:>7.1f}x  {recall:7.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+End-to-end throughput of the recognition and register routes, driven
+through the Flask test client against a throwaway instance folder (SQLite
+database, gallery snapshots) at several gallery sizes.
+
+    python -m benchmarks.end_to_end [--sizes 100 1000 10000 50000] [--requests 10]
+                                    [--faces 12] [--output results.json]
+
+Each gallery is filled with synthetic encodings; the uploaded photos are
+collages of static/student_photos, so every face is detected and encoded
+for real but matches nobody, which is the slowest path through matching.
+The encoding cache is disabled unless --with-cache is given, otherwise
+repeated uploads would be served from it. Results, including the
+per-stage p50/p95/p99 from the app's own metrics, are written as JSON.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import PIL.Image
+
+from benchmarks.images import PHOTO_DIR, make_collage
+from benchmarks.synthetic import make_gallery
+
+def _jpeg(array):
+    buffer = io.BytesIO()
+    PIL.Image.fromarray(array).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def _seed(app_module, size, seed):
+    """Replaces all students with `size` synthetic ones in one qualification and reloads the gallery."""
+    from encoding_format import pack
+    from models import db, Student, AttendanceRecord, Qualification, Module, LiveSession
+    with app_module.app.app_context():
+        AttendanceRecord.query.delete()
+        LiveSession.query.delete()
+        Student.query.delete()
+        db.session.commit()
+        qualification = Qualification.query.filter_by(name='Benchmark').first()
+        if qualification is None:
+            qualification = Qualification(name='Benchmark', description='benchmarks.end_to_end')
+            db.session.add(qualification)
+            db.session.commit()
+            db.session.add(Module(name='Benchmark', qualification_id=qualification.id))
+            db.session.commit()
+        module = Module.query.filter_by(qualification_id=qualification.id).first()
+        encodings = make_gallery(size, seed)
+        db.session.execute(Student.__table__.insert(), [
+            {
+                'student_id_number': f'synthetic-{i}',
+                'name': f'Synthetic {i}',
+                'username': f'synthetic-{i}@example.com',
+                'face_encoding': pack(encodings[i], app_module.app.config['ENCODING_STORAGE_DTYPE']),
+                'qualification_id': qualification.id,
+            }
+            for i in range(size)
+        ])
+        db.session.commit()
+        started = time.perf_counter()
+        app_module.load_known_faces()
+        return qualification.id, module.id, time.perf_counter() - started
+
+
+def _login(client, role, user):
+    with client.session_transaction() as session:
+        session['user'] = user
+        session['role'] = role
+
+
+def _measure(label, count, request):
+    """Calls request(i) `count` times; returns timing figures and the status codes seen."""
+    durations = []
+    statuses = {}
+    for i in range(count):
+        started = time.perf_counter()
+        response = request(i)
+        durations.append(time.perf_counter() - started)
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+    total = sum(durations)
+    ordered = sorted(durations)
+    result = {
+        'requests': count,
+        'seconds': round(total, 4),
+        'per_second': round(count / total, 3) if total else None,
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 2),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000, 2),
+        'statuses': statuses,
+    }
+    print(f"  {label:<16} {result['per_second']:>8} req/s  p50 {result['p50_ms']:>9} ms  p95 {result['p95_ms']:>9} ms")
+    return result
+
+
+def _run_size(app_module, size, args, group_photo, portraits):
+    from pipeline_metrics import PipelineMetrics
+    qualification_id, module_id, load_seconds = _seed(app_module, size, args.seed)
+    print(f'gallery {size}: loaded in {load_seconds:.2f}s')
+    app_module.pipeline_metrics = PipelineMetrics()
+    client = app_module.app.test_client()
+    routes = {}
+
+    _login(client, 'lecturer', 'benchmark')
+    routes['mark_attendance'] = _measure('mark_attendance', args.requests, lambda i: client.post(
+        '/attendance', data={'image': (io.BytesIO(group_photo), 'group.jpg')}
+    ))
+    routes['mark_register'] = _measure('mark_register', args.requests, lambda i: client.post(
+        '/mark-register',
+        data={'qualification_id': qualification_id, 'module_id': module_id, 'image': (io.BytesIO(group_photo), 'group.jpg')}
+    ))
+    client.post('/live-attendance/start', json={'qualification_id': qualification_id, 'module_id': module_id})
+    routes['live_attendance'] = _measure('live_attendance', args.requests, lambda i: client.post(
+        f'/live-attendance?qualification_id={qualification_id}&module_id={module_id}&seq={i}',
+        data=group_photo, content_type='image/jpeg'
+    ))
+    client.post('/live-attendance/stop', json={'qualification_id': qualification_id, 'module_id': module_id})
+
+    _login(client, 'admin', 'admin')
+    routes['enroll_student'] = _measure('enroll_student', args.requests, lambda i: client.post('/enroll', data={
+        'student_id': f'benchmark-{size}-{i}',
+        'student_username': f'benchmark-{size}-{i}@example.com',
+        'student_password': 'benchmark',
+        'qualification_id': qualification_id,
+        'image': (io.BytesIO(portraits[i % len(portraits)]), 'portrait.jpg'),
+    }))
+    return {
+        'gallery_size': size,
+        'gallery_load_seconds': round(load_seconds, 4),
+        'routes': routes,
+        'stages': app_module.pipeline_metrics.summary(),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 50000])
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--faces', type=int, default=12, help='faces in the uploaded group photo')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--with-cache', action='store_true', help='leave the upload encoding cache on')
+    parser.add_argument('--output', help='JSON file for the results (default: stdout)')
+    args = parser.parse_args()
+
+    instance = tempfile.mkdtemp(prefix='face-attendance-bench-')
+    # Must be set before the app is imported: it picks its instance folder then.
+    os.environ['INSTANCE_PATH'] = instance
+    import app as app_module
+    if not args.with_cache:
+        app_module.encoding_cache.max_entries = 0
+
+    group_photo = _jpeg(make_collage(args.faces))
+    portraits = []
+    for name in sorted(os.listdir(PHOTO_DIR)):
+        with open(os.path.join(PHOTO_DIR, name), 'rb') as f:
+            portraits.append(f.read())
+    existing_photos = set(os.listdir(PHOTO_DIR))
+    try:
+        results = [_run_size(app_module, size, args, group_photo, portraits) for size in args.sizes]
+    finally:
+        # Enrollment saves each photo next to the real ones; take them out again.
+        for name in set(os.listdir(PHOTO_DIR)) - existing_photos:
+            os.remove(os.path.join(PHOTO_DIR, name))
+        app_module.recognition_jobs.shutdown()
+        shutil.rmtree(instance, ignore_errors=True)
+
+    report = {
+        'benchmark': 'end_to_end',
+        'created_at': datetime.datetime.utcnow().isoformat() + 'Z',
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'config': {
+            'requests': args.requests,
+            'faces': args.faces,
+            'seed': args.seed,
+            'encoding_cache': args.with_cache,
+            'encoding_workers': app_module.app.config['ENCODING_WORKERS'],
+            'ann_min_gallery_size': app_module.app.config['ANN_MIN_GALLERY_SIZE'],
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'wrote {args.output}')
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
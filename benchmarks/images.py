@@ -0,0 +1,21 @@
+"""Group photos for the benchmarks, built from the enrolled photos in static/student_photos."""
+import os
+
+import numpy as np
+import PIL.Image
+
+PHOTO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'student_photos')
+
+
+def make_collage(faces, cell=320):
+    """A grid of `faces` student photos, each fitted into a cell x cell square, as an RGB array."""
+    photos = sorted(os.listdir(PHOTO_DIR))
+    columns = int(np.ceil(np.sqrt(faces)))
+    rows = int(np.ceil(faces / columns))
+    collage = PIL.Image.new('RGB', (columns * cell, rows * cell))
+    for i in range(faces):
+        with PIL.Image.open(os.path.join(PHOTO_DIR, photos[i % len(photos)])) as photo:
+            photo = photo.convert('RGB')
+            photo.thumbnail((cell, cell))
+            collage.paste(photo, ((i % columns) * cell, (i // columns) * cell))
+    return np.array(collage)
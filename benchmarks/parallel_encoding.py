@@ -0,0 +1,41 @@
+"""
+Timings for encoding every face of a large group photo with 1/2/4/8 pool
+processes.
+
+    python -m benchmarks.parallel_encoding [--faces 60] [--workers 1 2 4 8]
+
+The "lecture hall" is a grid collage of the enrolled photos in
+static/student_photos, repeated until it holds the requested number of
+faces. Detection runs once; only the encoding stage is timed.
+"""
+import argparse
+import time
+
+from benchmarks.images import make_collage
+from parallel_encoding import encode_faces_parallel
+
+def main():
+    import face_recognition
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--faces', type=int, default=60)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    image = make_collage(args.faces)
+    face_locations = face_recognition.face_locations(image)
+    print(f'{image.shape[1]}x{image.shape[0]} collage, {len(face_locations)} faces detected')
+    baseline = None
+    for workers in args.workers:
+        # Warm the pool so process start-up is not counted.
+        encode_faces_parallel(image, face_locations, workers=workers, min_faces_per_worker=1)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            encode_faces_parallel(image, face_locations, workers=workers, min_faces_per_worker=1)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        baseline = baseline or elapsed
+        print(f'{workers:>2} workers: {elapsed * 1000:8.1f} ms  ({baseline / elapsed:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+import contextlib
+import csv
+import io
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from encoding_format import pack
+from face_matcher import ENCODING_SIZE
+from models import db, Student, Qualification
+
+MANIFEST_NAMES = ('students.csv', 'manifest.csv')
+REQUIRED_COLUMNS = ('student_id', 'username', 'password', 'photo')
+# Rows per duplicate-check batch; bounds the (batch x gallery) distance matrix.
+DUPLICATE_BATCH = 512
+# Photos handed to the pool at a time, so a large archive is not read into memory at once.
+ENCODE_WINDOW = 256
+
+
+class PhotoSource:
+    """The photos of an import: a directory or an opened ZIP archive, addressed by relative path."""
+
+    def __init__(self, directory=None, archive=None):
+        self.directory = directory
+        self.archive = archive
+        self._names = set(archive.namelist()) if archive is not None else None
+
+    def exists(self, name):
+        if self.archive is not None:
+            return name in self._names
+        return os.path.isfile(os.path.join(self.directory, name))
+
+    def read(self, name):
+        if self.archive is not None:
+            return self.archive.read(name)
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            return f.read()
+
+    def manifest(self):
+        """Text of the students.csv/manifest.csv bundled with the photos, or None."""
+        for name in MANIFEST_NAMES:
+            if self.exists(name):
+                return self.read(name).decode('utf-8-sig')
+        return None
+
+
+@contextlib.contextmanager
+def open_photo_source(path):
+    """PhotoSource for a directory, or for a ZIP archive given as a path or file object."""
+    if isinstance(path, str) and os.path.isdir(path):
+        yield PhotoSource(directory=path)
+        return
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise ValueError("The upload is not a ZIP archive.")
+    with archive:
+        yield PhotoSource(archive=archive)
+
+
+def read_manifest(text):
+    """
+    Parses the import CSV. Columns: student_id, username, password, photo
+    (path inside the archive or directory), qualification_id or
+    qualification (by name), and optionally name.
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    columns = set(reader.fieldnames or [])
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if 'qualification_id' not in columns and 'qualification' not in columns:
+        missing.append('qualification_id')
+    if missing:
+        raise ValueError(f"Manifest is missing columns: {', '.join(missing)}")
+    return [
+        {key: (value or '').strip() for key, value in row.items() if key}
+        for row in reader
+    ]
+
+
+def prepare_student(image_bytes, password, detection_options=None, ingest_options=None):
+    """
+    Pool task: encodes the first face of an enrollment photo and hashes the
+    password, the two slow steps of enrolling. Returns (raw float64 encoding
+    bytes or None, password hash, reason the photo was unusable or None).
+    """
+    import face_recognition
+    from werkzeug.security import generate_password_hash
+    from face_detection import find_faces
+    from image_ingest import load_image, ImageRejected
+    options = dict(detection_options or {})
+    options['workers'] = 1
+    try:
+        image = load_image(image_bytes, **(ingest_options or {}))
+    except ImageRejected as e:
+        return None, None, str(e)
+    face_locations = find_faces(image, **options)
+    if not face_locations:
+        return None, None, "No face found in the image"
+    encoding = face_recognition.face_encodings(image, face_locations[:1])[0].tobytes()
+    return encoding, generate_password_hash(password), None
+
+
+def _prepare(args):
+    return prepare_student(*args)
+
+
+def _existing(column, values):
+    found = set()
+    values = list(values)
+    for start in range(0, len(values), 500):
+        found.update(v for (v,) in db.session.query(column).filter(column.in_(values[start:start + 500])))
+    return found
+
+
+def _check_rows(rows, source):
+    """Splits manifest rows into importable ones and (line, student_id, reason) rejections."""
+    qualifications = {q.name: q.id for q in Qualification.query.all()}
+    qualification_ids = set(qualifications.values())
+    taken_ids = _existing(Student.student_id_number, {r['student_id'] for r in rows})
+    taken_usernames = _existing(Student.username, {r['username'] for r in rows})
+    seen_ids, seen_usernames = set(), set()
+    accepted, skipped = [], []
+    for line, row in enumerate(rows, start=2):
+        student_id = row.get('student_id', '')
+        qualification_id = row.get('qualification_id') or qualifications.get(row.get('qualification', ''))
+        try:
+            qualification_id = int(qualification_id)
+        except (TypeError, ValueError):
+            qualification_id = None
+        if not all(row.get(c) for c in REQUIRED_COLUMNS):
+            reason = "Missing required fields"
+        elif qualification_id not in qualification_ids:
+            reason = "Unknown qualification"
+        elif student_id in taken_ids or student_id in seen_ids:
+            reason = "Student with this ID already exists"
+        elif row['username'] in taken_usernames or row['username'] in seen_usernames:
+            reason = "Username already in use"
+        elif not source.exists(row['photo']):
+            reason = "Photo not found"
+        else:
+            seen_ids.add(student_id)
+            seen_usernames.add(row['username'])
+            accepted.append((line, dict(row, qualification_id=qualification_id)))
+            continue
+        skipped.append({"line": line, "student_id": student_id, "reason": reason})
+    return accepted, skipped
+
+
+def _duplicate_faces(encodings, gallery, tolerance):
+    """
+    For each new encoding, why it cannot be enrolled, or None. Checks the
+    whole batch against the gallery, then against earlier rows of the
+    batch, a block of rows at a time.
+    """
+    reasons = [None] * len(encodings)
+    kept = np.zeros(len(encodings), dtype=bool)
+    sq_norms = np.einsum('ij,ij->i', encodings, encodings)
+    for start in range(0, len(encodings), DUPLICATE_BATCH):
+        block = encodings[start:start + DUPLICATE_BATCH]
+        enrolled = gallery.best_matches(block, tolerance) if len(gallery) else [(None, None)] * len(block)
+        # Distances from this block to every row up to its end.
+        end = start + len(block)
+        within = sq_norms[start:end, None] + sq_norms[None, :end] - 2.0 * (block @ encodings[:end].T)
+        np.maximum(within, 0, out=within)
+        np.sqrt(within, out=within)
+        for i, (student_id, _) in enumerate(enrolled):
+            row = start + i
+            if student_id is not None:
+                reasons[row] = f"Face matches enrolled student {student_id}"
+                continue
+            earlier = np.flatnonzero(kept[:row] & (within[i, :row] <= tolerance))
+            if len(earlier):
+                reasons[row] = earlier[0]
+                continue
+            kept[row] = True
+    return reasons
+
+
+def _save_photo(image_bytes, path):
+    # JPEGs are written as uploaded; anything else is converted like enroll_student does.
+    if image_bytes[:2] == b'\xff\xd8':
+        with open(path, 'wb') as f:
+            f.write(image_bytes)
+        return
+    import PIL.Image
+    with PIL.Image.open(io.BytesIO(image_bytes)) as img:
+        img.convert('RGB').save(path, 'JPEG')
+
+
+def import_students(rows, source, gallery, photo_dir, workers=1, detection_options=None,
+                    ingest_options=None, duplicate_tolerance=0.6, progress=None, storage_dtype='float32'):
+    """
+    Enrolls every valid manifest row in one go: photos are encoded and
+    passwords hashed across `workers` processes, faces are checked for
+    duplicates against the gallery and each other in vectorised batches,
+    and the students are inserted with a single executemany and one commit,
+    their encodings stored as `storage_dtype` (see encoding_format). The
+    caller rebuilds the gallery afterwards.
+
+    progress(stage, done, total) is called as work advances. Returns a
+    report dict with the enrolled count and the skipped rows with reasons.
+    """
+    def report(stage, done, total):
+        if progress is not None:
+            progress(stage, done, total)
+
+    accepted, skipped = _check_rows(rows, source)
+    report('encoding', 0, len(accepted))
+    prepared = []
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(accepted) > 1 else None
+    try:
+        for start in range(0, len(accepted), ENCODE_WINDOW):
+            tasks = [
+                (source.read(row['photo']), row['password'], detection_options, ingest_options)
+                for _, row in accepted[start:start + ENCODE_WINDOW]
+            ]
+            results = executor.map(_prepare, tasks, chunksize=4) if executor else map(_prepare, tasks)
+            for result in results:
+                prepared.append(result)
+                report('encoding', len(prepared), len(accepted))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    with_face = []
+    for (line, row), (encoding, password_hash, reason) in zip(accepted, prepared):
+        if encoding is None:
+            skipped.append({"line": line, "student_id": row['student_id'], "reason": reason})
+        else:
+            with_face.append((line, row, encoding, password_hash))
+
+    report('checking', 0, len(with_face))
+    encodings = np.array(
+        [np.frombuffer(encoding, dtype=np.float64) for _, _, encoding, _ in with_face]
+    ).reshape(-1, ENCODING_SIZE)
+    reasons = _duplicate_faces(encodings, gallery, duplicate_tolerance)
+    records = []
+    os.makedirs(photo_dir, exist_ok=True)
+    for (line, row, _, password_hash), encoding, reason in zip(with_face, encodings, reasons):
+        if reason is not None:
+            if not isinstance(reason, str):
+                reason = f"Same face as line {with_face[reason][0]}"
+            skipped.append({"line": line, "student_id": row['student_id'], "reason": reason})
+            continue
+        _save_photo(source.read(row['photo']), os.path.join(photo_dir, f"{row['student_id']}.jpg"))
+        records.append({
+            'student_id_number': row['student_id'],
+            'name': row.get('name') or f"Student {row['student_id']}",
+            'username': row['username'],
+            'face_encoding': pack(encoding, storage_dtype),
+            'password_hash': password_hash,
+            'qualification_id': row['qualification_id'],
+        })
+    report('saving', 0, len(records))
+    if records:
+        db.session.execute(Student.__table__.insert(), records)
+    db.session.commit()
+    report('saving', len(records), len(records))
+    skipped.sort(key=lambda s: s['line'])
+    return {"total": len(rows), "enrolled": len(records), "skipped": skipped}
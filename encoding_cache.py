@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from face_matcher import ENCODING_SIZE
+
+
+class EncodingCache:
+    """
+    Detected face boxes, encodings and faces turned away by the quality gate
+    of uploaded photos, keyed by a hash of the photo's bytes and the
+    detection settings, so a photo submitted again (a retry after a timeout,
+    re-marking a register) skips decoding, detection and encoding.
+
+    Up to max_entries photos are kept in memory and evicted least recently
+    used first. With a directory, entries are also written there as .npz
+    files, shared by every worker and kept across restarts; the directory
+    is pruned back to max_disk_entries, oldest first.
+    """
+
+    def __init__(self, max_entries=256, directory=None, max_disk_entries=4096):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(image_bytes, options=None):
+        digest = hashlib.sha256(json.dumps(options or {}, sort_keys=True).encode())
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns (face_locations, face_encodings, rejected_faces) for a cached photo, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        entry = self._read(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, entry)
+            return entry
+
+    def put(self, key, face_locations, face_encodings, rejected=()):
+        entry = (
+            [tuple(int(v) for v in box) for box in face_locations],
+            [np.asarray(e) for e in face_encodings],
+            list(rejected)
+        )
+        with self._lock:
+            self._remember(key, entry)
+        if self.directory:
+            self._write(key, entry)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def _read(self, key):
+        if not self.directory:
+            return None
+        try:
+            with np.load(self._path(key)) as data:
+                boxes, encodings = data['boxes'], data['encodings']
+                rejected = json.loads(str(data['rejected'])) if 'rejected' in data else []
+        except (OSError, KeyError, ValueError):
+            return None
+        return [tuple(int(v) for v in box) for box in boxes], list(encodings), rejected
+
+    def _write(self, key, entry):
+        boxes, encodings, rejected = entry
+        tmp_path = self._path(key) + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    boxes=np.asarray(boxes, dtype=np.int64).reshape(-1, 4),
+                    encodings=np.asarray(encodings, dtype=np.float64).reshape(-1, ENCODING_SIZE),
+                    rejected=np.array(json.dumps(rejected))
+                )
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Encoding cache write failed: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % 64 == 0
+        if prune:
+            self._prune()
+
+    def _prune(self):
+        try:
+            paths = [os.path.join(self.directory, n) for n in os.listdir(self.directory) if n.endswith('.npz')]
+            if len(paths) <= self.max_disk_entries:
+                return
+            paths.sort(key=os.path.getmtime)
+            for path in paths[:len(paths) - self.max_disk_entries]:
+                os.remove(path)
+        except OSError:
+            # Another worker pruned at the same time.
+            pass
@@ -0,0 +1,61 @@
+import struct
+
+import numpy as np
+
+# Stored face encodings start with a small header:
+#   magic b'FE', format version, dtype code, model version, a pad byte, dimension (uint16)
+# followed, for int8, by the float32 scale, and then the vector itself.
+# Encodings written before the header existed are raw float64 bytes.
+MAGIC = b'FE'
+FORMAT_VERSION = 1
+# face_recognition's dlib_face_recognition_resnet_model_v1.
+MODEL_VERSION = 1
+DTYPES = {'float64': 1, 'float32': 2, 'int8': 3}
+_HEADER = struct.Struct('<2sBBBxH')
+_SCALE = struct.Struct('<f')
+_NAMES = {code: name for name, code in DTYPES.items()}
+
+
+def pack(encoding, dtype='float32', model=MODEL_VERSION):
+    """
+    Serialises an encoding for the database. int8 stores the vector
+    quantised symmetrically with one scale per vector, a quarter of float32.
+    """
+    vector = np.asarray(encoding, dtype=np.float64).reshape(-1)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, DTYPES[dtype], model, len(vector))
+    if dtype == 'int8':
+        peak = float(np.abs(vector).max())
+        scale = peak / 127.0 if peak else 1.0
+        quantised = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return header + _SCALE.pack(scale) + quantised.tobytes()
+    return header + vector.astype(dtype).tobytes()
+
+
+def _parse(data):
+    # (dtype name, dimension, model version, offset of the vector)
+    if len(data) >= _HEADER.size:
+        magic, version, code, model, dim = _HEADER.unpack_from(data)
+        if magic == MAGIC and code in _NAMES:
+            if version != FORMAT_VERSION:
+                raise ValueError(f"Unsupported face encoding format version {version}")
+            offset = _HEADER.size + (_SCALE.size if _NAMES[code] == 'int8' else 0)
+            if len(data) == offset + dim * np.dtype(_NAMES[code]).itemsize:
+                return _NAMES[code], dim, model, offset
+    if len(data) % 8:
+        raise ValueError("Not a stored face encoding")
+    return 'float64', len(data) // 8, 0, 0
+
+
+def describe(data):
+    """(dtype name, dimension, model version) of a stored encoding; raw float64 is model 0."""
+    return _parse(data)[:3]
+
+
+def unpack(data, dtype=np.float32):
+    """Reads a stored encoding, with or without a header, as a `dtype` vector."""
+    name, dim, _, offset = _parse(data)
+    if name == 'int8':
+        (scale,) = _SCALE.unpack_from(data, _HEADER.size)
+        vector = np.frombuffer(data, dtype=np.int8, offset=offset, count=dim)
+        return (vector * np.float32(scale)).astype(dtype)
+    return np.frombuffer(data, dtype=name, offset=offset, count=dim).astype(dtype)
@@ -0,0 +1,138 @@
+import numpy as np
+import PIL.Image
+
+
+def _resize(image, scale):
+    height, width = image.shape[:2]
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    # reducing_gap lets Pillow shrink in the JPEG-friendly integer steps first.
+    return np.asarray(PIL.Image.fromarray(image).resize(size, PIL.Image.BILINEAR, reducing_gap=2.0))
+
+
+def scale_boxes(boxes, scale, shape):
+    """Maps (top, right, bottom, left) boxes found at `scale` back onto an image of `shape`."""
+    height, width = shape[:2]
+    mapped = []
+    for top, right, bottom, left in boxes:
+        mapped.append((
+            max(0, int(round(top / scale))),
+            min(width, int(round(right / scale))),
+            min(height, int(round(bottom / scale))),
+            max(0, int(round(left / scale))),
+        ))
+    return mapped
+
+
+def detect_faces(image, max_side=1600, pyramid=True, upsample=1, model='hog'):
+    """
+    Finds faces on a downscaled copy of the image so that detection cost no
+    longer grows with the camera's resolution, and returns the boxes in
+    full-resolution coordinates so encodings are still computed from the
+    original pixels.
+
+    The longest side is reduced to max_side (None or 0 detects at full
+    size). With pyramid set, a level that finds no faces is retried at twice
+    the scale, up to full resolution, which recovers photos where every face
+    is small.
+    """
+    import face_recognition
+    longest = max(image.shape[:2])
+    scale = min(1.0, max_side / longest) if max_side else 1.0
+    while True:
+        small = image if scale >= 1.0 else _resize(image, scale)
+        boxes = face_recognition.face_locations(small, number_of_times_to_upsample=upsample, model=model)
+        if boxes or not pyramid or scale >= 1.0:
+            break
+        scale = min(1.0, scale * 2)
+    if scale >= 1.0:
+        return boxes
+    return scale_boxes(boxes, scale, image.shape)
+
+
+def tile_windows(height, width, tile_size, overlap):
+    """(top, left, bottom, right) windows of at most tile_size pixels, overlapping by `overlap`."""
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        step = max(1, tile_size - overlap)
+        return list(range(0, length - tile_size, step)) + [length - tile_size]
+    return [
+        (y, x, min(y + tile_size, height), min(x + tile_size, width))
+        for y in starts(height)
+        for x in starts(width)
+    ]
+
+
+def detect_in_window(image, window, scale=1.0, upsample=1, model='hog'):
+    """Detects faces in one tile window and returns boxes in whole-image coordinates."""
+    import face_recognition
+    top, left, bottom, right = window
+    # Only the tile is copied, so memory stays bounded by the tile size.
+    tile = np.ascontiguousarray(image[top:bottom, left:right])
+    if scale < 1.0:
+        boxes = scale_boxes(
+            face_recognition.face_locations(_resize(tile, scale), number_of_times_to_upsample=upsample, model=model),
+            scale, tile.shape
+        )
+    else:
+        boxes = face_recognition.face_locations(tile, number_of_times_to_upsample=upsample, model=model)
+    return [(t + top, r + left, b + top, l + left) for t, r, b, l in boxes]
+
+
+def non_max_suppression(boxes, iou_threshold=0.3, containment_threshold=0.7):
+    """
+    Merges duplicate detections from overlapping tiles. HOG boxes carry no
+    score, so larger boxes are preferred: a face cut by a tile edge yields
+    a smaller partial box that is dropped when it mostly lies inside a kept
+    one or overlaps it by more than iou_threshold.
+    """
+    def area(box):
+        return max(0, box[1] - box[3]) * max(0, box[2] - box[0])
+
+    kept = []
+    for box in sorted(boxes, key=area, reverse=True):
+        duplicate = False
+        for other in kept:
+            inter_h = min(box[2], other[2]) - max(box[0], other[0])
+            inter_w = min(box[1], other[1]) - max(box[3], other[3])
+            if inter_h <= 0 or inter_w <= 0:
+                continue
+            inter = inter_h * inter_w
+            smaller = min(area(box), area(other)) or 1
+            if inter / float(area(box) + area(other) - inter) > iou_threshold or inter / float(smaller) > containment_threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(box)
+    return kept
+
+
+def detect_faces_tiled(image, tile_size=1600, overlap=200, scale=1.0, upsample=1, model='hog', workers=1):
+    """
+    Finds faces in a very large photo by detecting in overlapping tiles and
+    merging duplicates with non-maximum suppression. `overlap` should exceed
+    the largest expected face so every face lies whole in at least one tile;
+    each tile may also be downscaled by `scale`. With workers > 1 the tiles
+    are spread over the shared process pool.
+    """
+    windows = tile_windows(image.shape[0], image.shape[1], tile_size, overlap)
+    if workers > 1 and len(windows) > 1:
+        from parallel_encoding import detect_windows_parallel
+        boxes = detect_windows_parallel(image, windows, workers, scale, upsample, model)
+    else:
+        boxes = [box for window in windows for box in detect_in_window(image, window, scale, upsample, model)]
+    return non_max_suppression(boxes)
+
+
+def find_faces(image, max_side=1600, pyramid=True, tile_min_side=0, tile_size=1600, tile_overlap=200, workers=1):
+    """
+    Picks the detection strategy for a photo: detection on a downscaled
+    copy, plus tiled detection once its longest side reaches tile_min_side
+    (0 disables tiling). Tile boxes are merged with the whole-image boxes,
+    so a face too large for the tile overlap is still found whole.
+    """
+    boxes = detect_faces(image, max_side=max_side, pyramid=pyramid)
+    if tile_min_side and max(image.shape[:2]) >= tile_min_side:
+        tiled = detect_faces_tiled(image, tile_size=tile_size, overlap=tile_overlap, workers=workers)
+        boxes = non_max_suppression(boxes + tiled)
+    return boxes
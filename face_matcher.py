@@ -0,0 +1,382 @@
+import threading
+
+import numpy as np
+
+# Length of the descriptors produced by face_recognition.face_encodings.
+ENCODING_SIZE = 128
+
+# Group value stored for students that do not belong to any cohort.
+NO_GROUP = -1
+
+
+class FaceMatcher:
+    """
+    Keeps every enrolled face encoding in one contiguous matrix so that all
+    faces detected in a photo can be scored against all students with a
+    single batched distance computation instead of one compare_faces call
+    per face.
+
+    Each student can carry a group (their qualification) so that a register
+    for one cohort only scans that cohort's rows.
+
+    Large galleries can be given an approximate nearest-neighbour index, in
+    which case only the index's candidate rows are scored exactly.
+
+    A student enrolled from several photos is held as one gallery row, the
+    centroid of their templates, so the scan costs one vector per student.
+    Candidates whose centroid distance lies within refine_window of the
+    tolerance are then rescored against each of that student's templates,
+    keeping the closest, and best_matches looks at refine_candidates students
+    per face instead of one so a near miss can overtake the first centroid.
+
+    The gallery can be rebuilt wholesale with load() or kept up to date one
+    student at a time with add() and remove(). Rows are allocated
+    from a growable buffer and a removal only moves the last row into the
+    freed slot, so neither operation touches the rest of the gallery.
+    """
+
+    def __init__(self, encodings=None, student_ids=None, dtype=np.float64, index=None, index_min_size=20000,
+                 refine_window=0.1, refine_candidates=3):
+        self.dtype = dtype
+        self.refine_window = refine_window
+        self.refine_candidates = refine_candidates
+        # Optional approximate index (e.g. ann_index.IVFIndex), only consulted
+        # once the gallery has at least index_min_size students.
+        self.index = index
+        self.index_min_size = index_min_size
+        self._index_stale = True
+        self._lock = threading.Lock()
+        self.load(encodings if encodings is not None else [], student_ids if student_ids is not None else [])
+
+    def load(self, encodings, student_ids, groups=None, templates=None):
+        """
+        Replace the gallery with the given encodings, student ID numbers and
+        optional groups. templates maps the student ID numbers of students
+        with several templates to them; their encoding is the centroid.
+        """
+        if len(encodings) != len(student_ids):
+            raise ValueError("encodings and student_ids must have the same length")
+        if groups is None:
+            groups = [None] * len(student_ids)
+        if len(encodings):
+            matrix = np.ascontiguousarray(np.vstack(encodings), dtype=self.dtype)
+        else:
+            matrix = np.empty((0, ENCODING_SIZE), dtype=self.dtype)
+        with self._lock:
+            self._matrix = matrix
+            # Squared norms are cached so a match only costs one matrix product.
+            self._norms = np.einsum('ij,ij->i', matrix, matrix)
+            self._groups = np.array([NO_GROUP if g is None else g for g in groups], dtype=np.int64)
+            self._count = len(matrix)
+            self.student_ids = list(student_ids)
+            self._rows = {sid: row for row, sid in enumerate(self.student_ids)}
+            self._templates = {sid: self._stack(t) for sid, t in (templates or {}).items()}
+            self._index_stale = True
+            self._cohorts = None
+
+    def adopt(self, encodings, sq_norms, student_ids, groups=None, templates=None, index_state=None):
+        """
+        Use existing arrays as the gallery without copying them, e.g. the
+        read-only memory maps of a shared GalleryStore snapshot. The first
+        add/remove afterwards takes a private copy. index_state, as
+        returned by index_state(), restores the ANN index without rebuilding it.
+        """
+        with self._lock:
+            self._matrix = encodings
+            self._norms = sq_norms
+            if groups is None:
+                groups = np.full(len(encodings), NO_GROUP, dtype=np.int64)
+            self._groups = groups
+            self._count = len(encodings)
+            self.student_ids = list(student_ids)
+            self._rows = {sid: row for row, sid in enumerate(self.student_ids)}
+            self._templates = dict(templates or {})
+            self._index_stale = True
+            if index_state is not None and self.index is not None and len(index_state[2]) == len(encodings):
+                self.index.restore(*index_state)
+                self._index_stale = False
+            self._cohorts = None
+
+    def index_state(self):
+        """
+        The ANN index's (centroids, trained_size, cells), brought up to date
+        first, for publishing with the gallery; None while the gallery is
+        smaller than index_min_size.
+        """
+        with self._lock:
+            if self.index is None or self._count < self.index_min_size:
+                return None
+            if self._index_stale:
+                self.index.reset(self.encodings)
+                self._index_stale = False
+            return self.index.state()
+
+    def _stack(self, encodings):
+        return np.ascontiguousarray(np.vstack(encodings), dtype=self.dtype)
+
+    @property
+    def encodings(self):
+        """The (students x 128) gallery matrix, in the same order as student_ids."""
+        return self._matrix[:self._count]
+
+    @property
+    def sq_norms(self):
+        return self._norms[:self._count]
+
+    @property
+    def groups(self):
+        """Group (qualification ID) of each gallery row, NO_GROUP when unset."""
+        return self._groups[:self._count]
+
+    @property
+    def templates(self):
+        """{student_id: (templates x 128) matrix} for students with more than one template."""
+        return dict(self._templates)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, student_id):
+        return student_id in self._rows
+
+    def add(self, student_id, encoding, group=None, templates=None):
+        """
+        Add a student's encoding and group, replacing both if the student is
+        already in the gallery. With several templates, encoding is their
+        centroid.
+        """
+        vector = np.asarray(encoding, dtype=self.dtype).reshape(-1)
+        with self._lock:
+            row = self._rows.get(student_id)
+            if row is None:
+                row = self._count
+                if row == len(self._matrix):
+                    self._grow(vector.shape[0])
+                self._count += 1
+                self.student_ids.append(student_id)
+                self._rows[student_id] = row
+            if not self._matrix.flags.writeable:
+                self._grow(vector.shape[0])
+            self._matrix[row] = vector
+            self._norms[row] = vector @ vector
+            self._groups[row] = NO_GROUP if group is None else group
+            if templates is not None and len(templates) > 1:
+                self._templates[student_id] = self._stack(templates)
+            else:
+                self._templates.pop(student_id, None)
+            self._cohorts = None
+            if not self._index_stale:
+                self.index.set(row, vector)
+
+    def remove(self, student_id):
+        """Drop a student from the gallery. Returns False if they were not in it."""
+        with self._lock:
+            row = self._rows.pop(student_id, None)
+            if row is None:
+                return False
+            self._templates.pop(student_id, None)
+            last = self._count - 1
+            if row != last:
+                if not self._matrix.flags.writeable:
+                    self._grow(self._matrix.shape[1])
+                # Fill the hole with the last row so the gallery stays contiguous.
+                moved_id = self.student_ids[last]
+                self._matrix[row] = self._matrix[last]
+                self._norms[row] = self._norms[last]
+                self._groups[row] = self._groups[last]
+                self.student_ids[row] = moved_id
+                self._rows[moved_id] = row
+            self.student_ids.pop()
+            self._count = last
+            self._cohorts = None
+            if not self._index_stale:
+                self.index.remove(row, last)
+            return True
+
+    def _grow(self, dim):
+        capacity = max(16, 2 * len(self._matrix))
+        matrix = np.empty((capacity, dim), dtype=self.dtype)
+        norms = np.empty(capacity, dtype=self.dtype)
+        groups = np.empty(capacity, dtype=np.int64)
+        matrix[:self._count] = self._matrix[:self._count]
+        norms[:self._count] = self._norms[:self._count]
+        groups[:self._count] = self._groups[:self._count]
+        self._matrix, self._norms, self._groups = matrix, norms, groups
+
+    def _cohort_rows(self, group):
+        # Row lists per group are rebuilt lazily after the gallery changes.
+        if self._cohorts is None:
+            groups = self.groups
+            order = np.argsort(groups, kind='stable')
+            keys, starts = np.unique(groups[order], return_index=True)
+            self._cohorts = dict(zip(keys.tolist(), np.split(order, starts[1:])))
+        return self._cohorts.get(group, np.empty(0, dtype=np.intp))
+
+    def _as_faces(self, face_encodings, gallery):
+        return np.asarray(face_encodings, dtype=self.dtype).reshape(-1, gallery.shape[1])
+
+    def _candidates(self, face_encodings, k, group=None, tolerance=None):
+        """
+        Returns (rows, dists, student_ids): each face's k nearest gallery rows
+        with their exact distances, nearest first, padded with -1/inf when
+        fewer than k candidates exist. With a group only that cohort's rows
+        are scanned; otherwise large galleries go through the approximate
+        index and smaller ones through a full batched scan. With a tolerance,
+        near-threshold candidates are rescored against their templates.
+        """
+        # Take a consistent view of the gallery so a concurrent add/remove
+        # cannot shift rows between computing distances and reading IDs.
+        with self._lock:
+            gallery, norms = self.encodings, self.sq_norms
+            student_ids = list(self.student_ids)
+            cohort = self._cohort_rows(group) if group is not None else None
+            use_index = cohort is None and self.index is not None and len(gallery) >= self.index_min_size
+            if use_index and self._index_stale:
+                self.index.reset(gallery)
+                self._index_stale = False
+            faces = self._as_faces(face_encodings, gallery)
+            probed = self.index.search_rows(faces) if use_index and len(faces) else None
+            templates = self._templates if tolerance is not None and self.refine_window else None
+        rows = np.full((len(faces), k), -1, dtype=np.intp)
+        dists = np.full((len(faces), k), np.inf)
+        if cohort is not None:
+            gallery, norms = gallery[cohort], norms[cohort]
+        if not len(faces) or not len(gallery):
+            return rows, dists, student_ids
+        if probed is None:
+            full = _euclidean(faces, gallery, norms)
+            take = min(k, len(gallery))
+            top = np.argpartition(full, take - 1, axis=1)[:, :take]
+            top_dist = np.take_along_axis(full, top, axis=1)
+            order = np.argsort(top_dist, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            rows[:, :take] = top if cohort is None else cohort[top]
+            dists[:, :take] = np.take_along_axis(top_dist, order, axis=1)
+        else:
+            for f, cand in enumerate(probed):
+                d = _euclidean(faces[f:f + 1], gallery[cand], norms[cand])[0]
+                take = min(k, len(d))
+                if not take:
+                    continue
+                top = np.argpartition(d, take - 1)[:take]
+                top = top[np.argsort(d[top], kind='stable')]
+                rows[f, :take] = cand[top]
+                dists[f, :take] = d[top]
+        if templates:
+            rows, dists = self._refine(faces, rows, dists, student_ids, templates, tolerance)
+        return rows, dists, student_ids
+
+    def _refine(self, faces, rows, dists, student_ids, templates, tolerance):
+        """
+        Rescores candidates within refine_window of the tolerance against each
+        of their templates, keeping the closest distance, and re-sorts each
+        face's candidates. Clear matches and clear misses are left alone.
+        """
+        near = (rows >= 0) & (np.abs(dists - tolerance) <= self.refine_window)
+        changed = False
+        for f, j in zip(*np.nonzero(near)):
+            stack = templates.get(student_ids[rows[f, j]])
+            if stack is None:
+                continue
+            d = float(_euclidean(faces[f:f + 1], stack, np.einsum('ij,ij->i', stack, stack)).min())
+            if d < dists[f, j]:
+                dists[f, j] = d
+                changed = True
+        if changed:
+            order = np.argsort(dists, axis=1, kind='stable')
+            rows = np.take_along_axis(rows, order, axis=1)
+            dists = np.take_along_axis(dists, order, axis=1)
+        return rows, dists
+
+    def best_matches(self, face_encodings, tolerance=0.5, group=None):
+        """
+        Returns one (student_id, distance) pair per detected face. student_id is
+        None when the closest enrolled student is further away than tolerance.
+        With a group, only students of that group are considered.
+        """
+        k = self.refine_candidates if self._templates and self.refine_window else 1
+        rows, dists, student_ids = self._candidates(face_encodings, k, group, tolerance)
+        return [
+            (None, None) if row < 0 else (student_ids[row] if d <= tolerance else None, float(d))
+            for row, d in zip(rows[:, 0], dists[:, 0])
+        ]
+
+    def assign(self, face_encodings, tolerance=0.5, margin=0.0, candidates=5, group=None):
+        """
+        Resolves the face x student distance matrix into a one-to-one
+        assignment: each face claims at most one student and no student is
+        claimed twice. Pairs are accepted greedily from the closest distance
+        up, considering only each face's nearest `candidates` students.
+
+        A face whose best and second-best students are closer together than
+        `margin` is treated as ambiguous and left unassigned.
+
+        Returns one (student_id, distance) pair per face, like best_matches.
+        """
+        k = max(candidates, 2 if margin > 0 else 1)
+        rows, dists, student_ids = self._candidates(face_encodings, k, group, tolerance)
+        result = [(None, None) for _ in range(len(rows))]
+        if margin > 0:
+            # Faces with a single candidate give inf - inf; nan compares False.
+            with np.errstate(invalid='ignore'):
+                ambiguous = (dists[:, 1] - dists[:, 0]) < margin
+        else:
+            ambiguous = np.zeros(len(rows), dtype=bool)
+        claimed = set()
+        for flat in np.argsort(dists, axis=None, kind='stable'):
+            face, j = divmod(int(flat), k)
+            d = dists[face, j]
+            if d > tolerance:
+                break
+            student = int(rows[face, j])
+            if ambiguous[face] or result[face][0] is not None or student in claimed:
+                continue
+            claimed.add(student)
+            result[face] = (student_ids[student], float(d))
+        return result
+
+    def identify(self, face_encodings, tolerance=0.5, one_to_one=False, margin=0.0, group=None, fallback=False):
+        """
+        Returns one (student_id, distance) pair per face, using the one-to-one
+        assignment when one_to_one is set.
+
+        With a group, faces are matched against that cohort only; if fallback
+        is set, faces left unmatched are then tried against the full gallery
+        (e.g. students visiting from another qualification).
+        """
+        faces = np.asarray(face_encodings, dtype=self.dtype).reshape(-1, self.encodings.shape[1])
+        matches = self._match(faces, tolerance, one_to_one, margin, group)
+        if group is not None and fallback:
+            unmatched = [f for f, (sid, _) in enumerate(matches) if sid is None]
+            if unmatched:
+                claimed = {sid for sid, _ in matches if sid is not None}
+                retried = self._match(faces[unmatched], tolerance, one_to_one, margin, None)
+                for f, (sid, d) in zip(unmatched, retried):
+                    if sid is not None and sid not in claimed:
+                        matches[f] = (sid, d)
+                        claimed.add(sid)
+        return matches
+
+    def _match(self, faces, tolerance, one_to_one, margin, group):
+        if one_to_one:
+            return self.assign(faces, tolerance, margin, group=group)
+        return self.best_matches(faces, tolerance, group)
+
+    def any_match(self, face_encoding, tolerance=0.6):
+        """True if the encoding is within tolerance of any enrolled student."""
+        k = self.refine_candidates if self._templates and self.refine_window else 1
+        dists = self._candidates([face_encoding], k, tolerance=tolerance)[1]
+        return bool(dists[0, 0] <= tolerance)
+
+
+def _euclidean(faces, gallery, norms):
+    """(faces x gallery) euclidean distances using cached gallery squared norms."""
+    if not len(faces) or not len(gallery):
+        return np.empty((len(faces), len(gallery)), dtype=gallery.dtype)
+    # |a - b|^2 = |a|^2 + |b|^2 - 2ab, evaluated for every pair at once.
+    sq = faces @ gallery.T
+    sq *= -2.0
+    sq += np.einsum('ij,ij->i', faces, faces)[:, None]
+    sq += norms[None, :]
+    np.maximum(sq, 0.0, out=sq)
+    return np.sqrt(sq, out=sq)
@@ -0,0 +1,72 @@
+import numpy as np
+import PIL.Image
+
+# Side of the square grey crop the sharpness score is measured on, so the
+# score does not depend on how large the face is in the photo.
+SHARPNESS_SIZE = 64
+
+
+def sharpness(image, box):
+    """Variance of the Laplacian of the face crop: low for blurred or out-of-focus faces."""
+    top, right, bottom, left = box
+    crop = PIL.Image.fromarray(np.ascontiguousarray(image[top:bottom, left:right])).convert('L')
+    grey = np.asarray(crop.resize((SHARPNESS_SIZE, SHARPNESS_SIZE), PIL.Image.BILINEAR), dtype=np.float32)
+    laplacian = (
+        grey[:-2, 1:-1] + grey[2:, 1:-1] + grey[1:-1, :-2] + grey[1:-1, 2:] - 4.0 * grey[1:-1, 1:-1]
+    )
+    return float(laplacian.var())
+
+
+def yaw(landmarks):
+    """
+    How far the head is turned, from 5-point landmarks: the nose tip's
+    horizontal offset from the midpoint of the eyes, in eye distances.
+    About 0 when facing the camera, above 1 in profile.
+    """
+    left_eye = np.mean(landmarks['left_eye'], axis=0)
+    right_eye = np.mean(landmarks['right_eye'], axis=0)
+    nose = np.asarray(landmarks['nose_tip'][0], dtype=float)
+    eye_distance = np.linalg.norm(right_eye - left_eye)
+    if eye_distance < 1.0:
+        # Eyes on top of each other: a full profile.
+        return 10.0
+    return float(abs(nose[0] - (left_eye[0] + right_eye[0]) / 2.0) / eye_distance)
+
+
+def assess_faces(image, face_locations, min_size=0, min_sharpness=0.0, max_yaw=0.0):
+    """
+    Pre-encoding quality gate. Returns (kept, rejected): the indices of the
+    boxes worth encoding, and a {"box", "reason", "score"} dict for each
+    rejected one. Checks run cheapest first (box size, then sharpness, then
+    a 5-point landmark pose estimate) and only on faces still in the
+    running; a threshold of 0 turns its check off.
+    """
+    kept, rejected = [], []
+
+    def reject(i, reason, score):
+        rejected.append({"box": list(face_locations[i]), "reason": reason, "score": round(score, 2)})
+
+    for i, (top, right, bottom, left) in enumerate(face_locations):
+        size = min(bottom - top, right - left)
+        if min_size and size < min_size:
+            reject(i, "too_small", size)
+            continue
+        if min_sharpness:
+            score = sharpness(image, face_locations[i])
+            if score < min_sharpness:
+                reject(i, "blurred", score)
+                continue
+        kept.append(i)
+
+    if max_yaw and kept:
+        import face_recognition
+        landmarks = face_recognition.face_landmarks(image, [face_locations[i] for i in kept], model='small')
+        frontal = []
+        for i, points in zip(kept, landmarks):
+            score = yaw(points)
+            if score > max_yaw:
+                reject(i, "turned_away", score)
+            else:
+                frontal.append(i)
+        kept = frontal
+    return kept, rejected
@@ -0,0 +1,64 @@
+import numpy as np
+
+from encoding_format import pack, unpack
+from models import db, Student, StudentTemplate
+
+# Template sources in the order they are dropped to make room for newer
+# ones: learned templates before photos an admin added. Enrollment
+# templates are never dropped.
+EVICTION_ORDER = ('attendance', 'photo')
+
+
+def decode(encoding_bytes):
+    return unpack(encoding_bytes, np.float64)
+
+
+def student_templates(student):
+    """A student's template encodings; the enrollment encoding alone if they have no templates."""
+    if student.templates:
+        return [decode(t.encoding) for t in student.templates]
+    return [decode(student.face_encoding)] if student.face_encoding else []
+
+
+def nearest_template(student, encoding):
+    """Distance from an encoding to the closest of the student's templates (inf without any)."""
+    templates = student_templates(student)
+    if not templates:
+        return float('inf')
+    return float(np.linalg.norm(np.vstack(templates) - np.asarray(encoding), axis=1).min())
+
+
+def add_template(student, encoding, source, max_templates=5, dtype='float32'):
+    """
+    Adds an encoding to the student's templates and refreshes the centroid in
+    Student.face_encoding. The enrollment encoding becomes the first template
+    when the student has none yet. Past max_templates the oldest learned
+    (attendance) template is dropped, or failing that the oldest added
+    photo. New encodings are stored as `dtype` (see encoding_format).
+    Returns the student's templates; the caller commits.
+    """
+    if not student.templates and student.face_encoding:
+        student.templates.append(StudentTemplate(encoding=student.face_encoding, source='enrollment'))
+    student.templates.append(StudentTemplate(encoding=pack(encoding, dtype), source=source))
+    droppable = [t for kind in EVICTION_ORDER for t in student.templates if t.source == kind]
+    while len(student.templates) > max_templates and droppable:
+        student.templates.remove(droppable.pop(0))
+    templates = student_templates(student)
+    student.face_encoding = pack(np.mean(templates, axis=0), dtype)
+    return templates
+
+
+def gallery_templates():
+    """
+    {student_id_number: [encodings]} for every student with more than one
+    template, in one query, for loading the matcher.
+    """
+    rows = (
+        db.session.query(Student.student_id_number, StudentTemplate.encoding)
+        .join(StudentTemplate, StudentTemplate.student_id == Student.id)
+        .order_by(StudentTemplate.id)
+    )
+    templates = {}
+    for student_id, encoding in rows:
+        templates.setdefault(student_id, []).append(decode(encoding))
+    return {sid: encodings for sid, encodings in templates.items() if len(encodings) > 1}
@@ -0,0 +1,103 @@
+def box_iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    inter_h = min(a[2], b[2]) - max(a[0], b[0])
+    inter_w = min(a[1], b[1]) - max(a[3], b[3])
+    if inter_h <= 0 or inter_w <= 0:
+        return 0.0
+    inter = inter_h * inter_w
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    def __init__(self, box):
+        self.box = box
+        self.student_id = None
+        self.hits = 0     # consecutive frames matched to student_id
+        self.misses = 0   # consecutive frames without a box
+        self.skipped = 0  # frames reused without re-encoding since the last check
+
+
+class FaceTracker:
+    """
+    Follows faces between frames of one live session so that students who
+    stay in their seats are not re-encoded every scan.
+
+    New boxes are associated with existing tracks by IoU. A track becomes
+    confirmed once the same student has been matched on it `confirm_after`
+    frames in a row; from then on its box is reported as that student
+    without computing an encoding, except every `reverify_every` frames
+    when it is checked again in case someone changed seats.
+    """
+
+    def __init__(self, iou_threshold=0.4, confirm_after=2, max_misses=3, reverify_every=12):
+        self.iou_threshold = iou_threshold
+        self.confirm_after = confirm_after
+        self.max_misses = max_misses
+        self.reverify_every = reverify_every
+        self.tracks = []
+        self._pending = {}
+
+    def update(self, boxes):
+        """
+        Takes this frame's face boxes. Returns (to_encode, known): the indices
+        of boxes that need a fresh encoding, and the student IDs of the boxes
+        covered by confirmed tracks.
+        """
+        pairs = sorted(
+            ((box_iou(box, track.box), b, t) for b, box in enumerate(boxes) for t, track in enumerate(self.tracks)),
+            reverse=True
+        )
+        box_track = {}
+        used_tracks = set()
+        for iou, b, t in pairs:
+            if iou < self.iou_threshold:
+                break
+            if b in box_track or t in used_tracks:
+                continue
+            box_track[b] = self.tracks[t]
+            used_tracks.add(t)
+
+        for t, track in enumerate(self.tracks):
+            if t not in used_tracks:
+                track.misses += 1
+        self.tracks = [
+            track for t, track in enumerate(self.tracks)
+            if t in used_tracks or track.misses <= self.max_misses
+        ]
+
+        to_encode, known = [], []
+        self._pending = {}
+        for b, box in enumerate(boxes):
+            track = box_track.get(b)
+            if track is None:
+                track = Track(box)
+                self.tracks.append(track)
+            track.box = box
+            track.misses = 0
+            if track.student_id is not None and track.hits >= self.confirm_after and track.skipped < self.reverify_every:
+                track.skipped += 1
+                known.append(track.student_id)
+            else:
+                self._pending[len(to_encode)] = track
+                to_encode.append(b)
+        return to_encode, known
+
+    def resolve(self, matches):
+        """
+        Feeds back the (student_id, distance) match for each box returned in
+        to_encode by the last update(), in the same order.
+        """
+        for i, (student_id, _) in enumerate(matches):
+            track = self._pending.get(i)
+            if track is None:
+                continue
+            if student_id is not None and student_id == track.student_id:
+                track.hits += 1
+            else:
+                track.student_id = student_id
+                track.hits = 1 if student_id is not None else 0
+            track.skipped = 0
+        self._pending = {}
+
@@ -0,0 +1,145 @@
+import contextlib
+import json
+import os
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines run a single process anyway.
+    fcntl = None
+
+
+class GalleryStore:
+    """
+    Versioned on-disk snapshots of the face gallery, shared by every gunicorn
+    worker. Each version is written once to its own set of files and then
+    memory-mapped read-only, so all workers share the same pages instead of
+    each holding a private copy of the encoding matrix.
+
+    Students with several templates have them stored alongside as one
+    stacked matrix plus a JSON list of (student_id, count) runs, and large
+    galleries with the ANN index's centroids and cell of every row, so only
+    the publishing worker ever trains or reassigns the index.
+
+    The current version number lives in the database (GalleryState); a
+    version is only recorded there after its files are complete.
+    """
+
+    def __init__(self, directory, keep=3):
+        self.directory = directory
+        self.keep = keep
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._lock_file = None
+
+    def _paths(self, version):
+        base = os.path.join(self.directory, f'gallery-{version}')
+        return base + '.encodings.npy', base + '.norms.npy', base + '.groups.npy', base + '.ids.json'
+
+    def _template_paths(self, version):
+        base = os.path.join(self.directory, f'gallery-{version}')
+        return base + '.templates.npy', base + '.template-ids.json'
+
+    def _index_path(self, version):
+        return os.path.join(self.directory, f'gallery-{version}.ivf.npz')
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        Serialises writers across worker processes and threads. Re-entrant
+        within a thread, so a locked section may call helpers that lock too.
+        """
+        with self._thread_lock:
+            if self._depth == 0:
+                os.makedirs(self.directory, exist_ok=True)
+                self._lock_file = open(os.path.join(self.directory, 'gallery.lock'), 'w')
+                if fcntl:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    # Closing the file releases the flock.
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def write(self, version, encodings, sq_norms, groups, student_ids, templates=None, index_state=None):
+        """
+        Write a complete snapshot for the given version and prune old ones.
+        templates maps student IDs to their (templates x 128) matrices and
+        index_state is FaceMatcher.index_state().
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        encodings_path, norms_path, groups_path, ids_path = self._paths(version)
+        templates_path, template_ids_path = self._template_paths(version)
+        templates = templates or {}
+        runs = [[sid, len(stack)] for sid, stack in templates.items()]
+        stacked = np.vstack(list(templates.values())) if templates else np.empty((0, encodings.shape[1]))
+        arrays = ((encodings_path, encodings), (norms_path, sq_norms), (groups_path, groups), (templates_path, stacked))
+        for path, array in arrays:
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(path + '.tmp', path)
+        if index_state is not None:
+            centroids, trained_size, cells = index_state
+            index_path = self._index_path(version)
+            with open(index_path + '.tmp', 'wb') as f:
+                np.savez(f, centroids=centroids, trained_size=trained_size, cells=cells)
+            os.replace(index_path + '.tmp', index_path)
+        # The template IDs go before the student IDs, which readers treat as the sign of a complete snapshot.
+        for path, value in ((template_ids_path, runs), (ids_path, list(student_ids))):
+            with open(path + '.tmp', 'w') as f:
+                json.dump(value, f)
+            os.replace(path + '.tmp', path)
+        self._prune(version)
+
+    def read(self, version):
+        """
+        Map a snapshot read-only. Returns (encodings, sq_norms, student_ids,
+        groups, templates, index_state), or None if the files for that
+        version are missing. index_state is None when none was saved.
+        """
+        encodings_path, norms_path, groups_path, ids_path = self._paths(version)
+        templates_path, template_ids_path = self._template_paths(version)
+        try:
+            encodings = np.load(encodings_path, mmap_mode='r')
+            sq_norms = np.load(norms_path, mmap_mode='r')
+            groups = np.load(groups_path, mmap_mode='r')
+            with open(ids_path) as f:
+                student_ids = json.load(f)
+        except FileNotFoundError:
+            return None
+        templates = {}
+        try:
+            stacked = np.load(templates_path, mmap_mode='r')
+            with open(template_ids_path) as f:
+                runs = json.load(f)
+        except FileNotFoundError:
+            # Snapshot written before templates were stored.
+            runs = []
+        start = 0
+        for sid, count in runs:
+            templates[sid] = stacked[start:start + count]
+            start += count
+        index_state = None
+        try:
+            with np.load(self._index_path(version)) as data:
+                index_state = data['centroids'], int(data['trained_size']), data['cells']
+        except FileNotFoundError:
+            pass
+        return encodings, sq_norms, student_ids, groups, templates, index_state
+
+    def _prune(self, version):
+        for name in os.listdir(self.directory):
+            prefix, _, rest = name.partition('-')
+            old = rest.split('.', 1)[0]
+            if prefix != 'gallery' or not old.isdigit() or int(old) > version - self.keep:
+                continue
+            # Workers still mapping an old version keep their pages on POSIX;
+            # on Windows the unlink fails and is retried on the next write.
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,55 @@
+import io
+
+import numpy as np
+import PIL.Image
+import PIL.ImageOps
+
+
+class ImageRejected(ValueError):
+    """Raised for uploads that are not a readable image or exceed the size limits."""
+
+
+def read_upload(source, max_bytes=0):
+    """Bytes of an upload given as bytes or a file object, refusing more than max_bytes (0 = no limit)."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+    else:
+        data = source.read(max_bytes + 1) if max_bytes else source.read()
+    if max_bytes and len(data) > max_bytes:
+        raise ImageRejected(f"Image is larger than {max_bytes // (1024 * 1024)} MB.")
+    return data
+
+
+def load_image(source, max_side=0, max_pixels=0, max_bytes=0, tile_min_side=0):
+    """
+    Decodes an uploaded photo once into an RGB array, replacing
+    face_recognition.load_image_file for every upload path.
+
+    JPEGs are decoded with DCT scaling (Pillow's draft mode) straight to
+    the smallest 1/2, 1/4 or 1/8 size whose longest side is still at least
+    max_side (0 = full size); with max_side 1600 a 12 MP phone photo is
+    decoded at 2016x1512 and never held at full resolution. Only photos
+    whose longest side reaches tile_min_side (0 = never), which detection
+    also searches tile by tile, are decoded at full size. The EXIF
+    orientation is applied, so faces in sideways phone photos are upright
+    for detection. Images over max_pixels pixels or max_bytes bytes are
+    rejected before decoding.
+    """
+    data = read_upload(source, max_bytes)
+    try:
+        img = PIL.Image.open(io.BytesIO(data))
+    except (OSError, PIL.Image.DecompressionBombError) as e:
+        raise ImageRejected("Upload is not a readable image.") from e
+    with img:
+        width, height = img.size
+        if max_pixels and width * height > max_pixels:
+            raise ImageRejected(f"Image has more than {max_pixels // 1000000} megapixels.")
+        longest = max(width, height)
+        tiled = tile_min_side and longest >= tile_min_side
+        if max_side and img.format == 'JPEG' and longest > max_side and not tiled:
+            img.draft('RGB', (width * max_side // longest, height * max_side // longest))
+        try:
+            img = PIL.ImageOps.exif_transpose(img)
+            return np.array(img.convert('RGB'))
+        except (OSError, SyntaxError) as e:
+            raise ImageRejected("Upload is not a readable image.") from e
@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+
+
+class FrameDropped(Exception):
+    """Raised when a live frame is skipped by its session's FramePacer; args[0] is the reason."""
+
+
+class SessionRegistry:
+    """
+    Per-live-session objects held by this worker, created on first use by
+    factory(). The least recently used are dropped beyond max_sessions.
+    """
+
+    def __init__(self, factory, max_sessions=256):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            item = self._items.pop(session_id, None)
+            if item is None:
+                item = self.factory()
+            self._items[session_id] = item
+            while len(self._items) > self.max_sessions:
+                self._items.popitem(last=False)
+            return item
+
+    def discard(self, session_id):
+        with self._lock:
+            self._items.pop(session_id, None)
+
+
+class FramePacer:
+    """
+    Backpressure for one live session. At most one frame is processed at a
+    time; a frame arriving while another is in flight, or one older than the
+    newest frame already taken, is dropped rather than queued. The interval
+    suggested to the client follows a moving average of the processing time,
+    which already stretches when the server is busy with other sessions.
+    """
+
+    def __init__(self, min_interval=2.0, max_interval=30.0, headroom=1.5, smoothing=0.3):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.headroom = headroom
+        self.smoothing = smoothing
+        self.average_seconds = None
+        self._busy = False
+        self._last_seq = None
+        self._lock = threading.Lock()
+
+    def begin(self, seq=None):
+        """
+        Claims the session for one frame. Returns None when the frame should
+        be processed, otherwise 'busy' or 'stale' as the reason to drop it.
+        Every successful begin() must be followed by finish().
+        """
+        with self._lock:
+            if self._busy:
+                return 'busy'
+            if seq is not None and self._last_seq is not None and seq <= self._last_seq:
+                return 'stale'
+            self._busy = True
+            if seq is not None:
+                self._last_seq = seq
+            return None
+
+    def finish(self, elapsed):
+        with self._lock:
+            self._busy = False
+            if self.average_seconds is None:
+                self.average_seconds = elapsed
+            else:
+                self.average_seconds += self.smoothing * (elapsed - self.average_seconds)
+
+    def next_interval(self):
+        """Seconds the client should wait before sending its next frame."""
+        if self.average_seconds is None:
+            return self.min_interval
+        return round(min(self.max_interval, max(self.min_interval, self.average_seconds * self.headroom)), 2)
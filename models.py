@@ -15,8 +15,12 @@ class Student(db.Model):
     username = db.Column(db.String(128), unique=True, nullable=False)
     face_encoding = db.Column(db.LargeBinary)
     password_hash = db.Column(db.String(128))
-    qualification_id = db.Column(db.Integer, db.ForeignKey('qualification.id'))
+    qualification_id = db.Column(db.Integer, db.ForeignKey('qualification.id'), index=True)
     qualification = db.relationship('Qualification', backref=db.backref('students', lazy=True))
+    templates = db.relationship(
+        'StudentTemplate', backref='student', lazy=True, cascade='all, delete-orphan',
+        order_by='StudentTemplate.id'
+    )
     
 
     def set_password(self, password):
@@ -27,6 +31,19 @@ class Student(db.Model):
         return f"Student('{self.name}', '{self.student_id_number}', '{self.username}')"
 
 
+class StudentTemplate(db.Model):
+    """
+    One of a student's face encodings. Students with templates are matched by
+    the centroid of them, stored in Student.face_encoding; a student without
+    any has the single encoding from their enrollment photo.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False, index=True)
+    encoding = db.Column(db.LargeBinary, nullable=False)
+    source = db.Column(db.String(16), nullable=False)  # "enrollment", "photo" or "attendance"
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
 class Lecturer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -101,6 +118,13 @@ class Module(db.Model):
 
 
 class AttendanceRecord(db.Model):
+    __table_args__ = (
+        # A student's history, newest first (student dashboard, attendance records).
+        db.Index('ix_attendance_record_student_date', 'student_id', 'date_time'),
+        # The rows of one register or live session, which share module,
+        # qualification and timestamp; status narrows to the Present rows.
+        db.Index('ix_attendance_record_register', 'module_id', 'qualification_id', 'date_time', 'status'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
     module_id = db.Column(db.Integer, db.ForeignKey('module.id'), nullable=False)
@@ -111,4 +135,34 @@ class AttendanceRecord(db.Model):
 
     student = db.relationship('Student', backref='attendance_records')
     module = db.relationship('Module')
-    qualification = db.relationship('Qualification')
\ No newline at end of file
+    qualification = db.relationship('Qualification')
+
+
+class GalleryState(db.Model):
+    """Single-row counter bumped each time the shared face gallery snapshot is rewritten."""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class LiveSession(db.Model):
+    """
+    A live camera attendance session. Scans only add Present rows for newly
+    seen students (stamped with started_at); Absent rows are written once
+    when the session is stopped.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    lecturer_username = db.Column(db.String(50), nullable=False)
+    module_id = db.Column(db.Integer, db.ForeignKey('module.id'), nullable=False)
+    qualification_id = db.Column(db.Integer, db.ForeignKey('qualification.id'), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    ended_at = db.Column(db.DateTime)  # None while the session is open
+
+
+class RecognitionJob(db.Model):
+    """A photo queued for background recognition, polled through /jobs/<id>."""
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)  # "attendance" or "register"
+    status = db.Column(db.String(16), nullable=False, default='queued')  # "queued", "done" or "failed"
+    result = db.Column(db.Text)  # JSON, set once the job finishes
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
@@ -0,0 +1,106 @@
+import contextlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching always registers the block, but pool
+        # processes share the parent's resource tracker, whose registry is a
+        # set, so the parent's unlink still clears it exactly once.
+        return shared_memory.SharedMemory(name=name)
+
+
+@contextlib.contextmanager
+def _shared_image(image):
+    """Copies the image once into a shared memory block; yields (name, shape, dtype) for pool tasks."""
+    image = np.ascontiguousarray(image)
+    shm = shared_memory.SharedMemory(create=True, size=image.nbytes)
+    try:
+        np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[...] = image
+        yield shm.name, image.shape, image.dtype.str
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+@contextlib.contextmanager
+def _mapped_image(shm_name, shape, dtype):
+    shm = _attach(shm_name)
+    image = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    try:
+        yield image
+    finally:
+        # The view must be dropped before the block can be closed.
+        del image
+        shm.close()
+
+
+def _encode_chunk(shm_name, shape, dtype, face_locations):
+    """Pool task: encode some of the faces of an image that lives in shared memory."""
+    import face_recognition
+    with _mapped_image(shm_name, shape, dtype) as image:
+        return face_recognition.face_encodings(image, face_locations)
+
+
+def _detect_chunk(shm_name, shape, dtype, windows, scale, upsample, model):
+    """Pool task: detect faces in some of the tiles of an image that lives in shared memory."""
+    from face_detection import detect_in_window
+    with _mapped_image(shm_name, shape, dtype) as image:
+        return [box for window in windows for box in detect_in_window(image, window, scale, upsample, model)]
+
+
+def _get_executor(workers):
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=workers)
+            _executor_workers = workers
+        return _executor
+
+
+def _run_chunks(image, task, items, tasks, workers, *extra):
+    """Splits items into `tasks` chunks, runs task on each in the pool and concatenates the results in order."""
+    with _shared_image(image) as (name, shape, dtype):
+        executor = _get_executor(workers)
+        futures = [
+            executor.submit(task, name, shape, dtype, [items[i] for i in chunk], *extra)
+            for chunk in np.array_split(np.arange(len(items)), tasks)
+        ]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
+
+def encode_faces_parallel(image, face_locations, workers=1, min_faces_per_worker=4):
+    """
+    Computes the 128-d descriptors for the given face boxes, splitting the
+    boxes across a process pool. The decoded image is copied once into
+    shared memory and mapped by every task instead of being pickled per
+    task. Returns encodings in the same order as face_locations.
+
+    Photos with too few faces to give each worker `min_faces_per_worker`
+    boxes, or workers <= 1, are encoded in-process.
+    """
+    import face_recognition
+    tasks = min(workers, len(face_locations) // max(1, min_faces_per_worker))
+    if tasks <= 1:
+        return face_recognition.face_encodings(image, face_locations)
+    return _run_chunks(image, _encode_chunk, face_locations, tasks, workers)
+
+
+def detect_windows_parallel(image, windows, workers, scale=1.0, upsample=1, model='hog'):
+    """Runs face_detection.detect_in_window for every tile window across the process pool."""
+    return _run_chunks(image, _detect_chunk, windows, min(workers, len(windows)), workers, scale, upsample, model)
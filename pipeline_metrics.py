@@ -0,0 +1,120 @@
+import bisect
+import contextlib
+import threading
+import time
+from collections import deque
+
+# Upper bounds, in seconds, of the histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class StageHistogram:
+    """
+    Durations of one pipeline stage: cumulative bucket counts and a running
+    sum for Prometheus, plus the most recent `window` samples from which
+    p50/p95/p99 are read.
+    """
+
+    def __init__(self, window=1024):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+    def quantiles(self):
+        ordered = sorted(self.recent)
+        if not ordered:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+
+class PipelineMetrics:
+    """
+    Per-stage timings of the recognition routes, keyed by (route, stage),
+    for this worker. Each worker keeps its own figures; the route label
+    tells apart e.g. mark_register's detection from live_attendance's.
+    """
+
+    def __init__(self, window=1024):
+        self.window = window
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get((route, stage))
+            if histogram is None:
+                histogram = self._histograms[(route, stage)] = StageHistogram(self.window)
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def time(self, route, stage, timings=None):
+        """
+        Times the with-block as `stage` of `route`. The duration is also
+        added to the `timings` dict, if given, for the request's log line.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe(route, stage, elapsed)
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + elapsed
+
+    def summary(self):
+        """{route: {stage: {count, sum, p50, p95, p99}}}"""
+        with self._lock:
+            result = {}
+            for (route, stage), histogram in sorted(self._histograms.items()):
+                quantiles = histogram.quantiles()
+                result.setdefault(route, {})[stage] = {
+                    "count": histogram.count,
+                    "sum": round(histogram.total, 6),
+                    "p50": quantiles[0.5],
+                    "p95": quantiles[0.95],
+                    "p99": quantiles[0.99],
+                }
+            return result
+
+    def prometheus(self, extra=None):
+        """
+        Renders the stage histograms, the recent quantiles and any extra
+        {name: (type, help, value)} metrics in the Prometheus text format.
+        """
+        lines = [
+            '# HELP recognition_stage_seconds Duration of each recognition pipeline stage.',
+            '# TYPE recognition_stage_seconds histogram',
+        ]
+        with self._lock:
+            items = sorted(self._histograms.items())
+            for (route, stage), histogram in items:
+                labels = f'route="{route}",stage="{stage}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'recognition_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'recognition_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'recognition_stage_seconds_sum{{{labels}}} {histogram.total:.6f}')
+                lines.append(f'recognition_stage_seconds_count{{{labels}}} {histogram.count}')
+            lines.append(
+                f'# HELP recognition_stage_recent_seconds Quantiles of the last {self.window} durations of each stage.'
+            )
+            lines.append('# TYPE recognition_stage_recent_seconds gauge')
+            for (route, stage), histogram in items:
+                for q, value in histogram.quantiles().items():
+                    lines.append(
+                        f'recognition_stage_recent_seconds{{route="{route}",stage="{stage}",quantile="{q}"}} {value:.6f}'
+                    )
+        for name, (kind, help_text, value) in sorted((extra or {}).items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
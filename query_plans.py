@@ -0,0 +1,66 @@
+import contextlib
+import datetime
+
+from sqlalchemy import event
+
+from attendance_writer import cohort_students, live_session_arrivals, live_session_present, student_attendance
+from models import LiveSession
+
+# Tables the attendance hot queries must only reach through an index.
+HOT_TABLES = ('attendance_record', 'student')
+
+
+def hot_queries():
+    """(name, run) for each attendance hot query; run() needs an app context."""
+    # Never saved: the queries only read its attributes.
+    live_session = LiveSession(module_id=1, qualification_id=1, started_at=datetime.datetime(2000, 1, 1))
+    return (
+        ('student attendance', lambda: student_attendance(1).all()),
+        ('cohort students', lambda: cohort_students(1)),
+        ('live session present', lambda: live_session_present(live_session)),
+        ('live session arrivals', lambda: live_session_arrivals(live_session, 0)),
+    )
+
+
+@contextlib.contextmanager
+def captured_statements(engine):
+    """Collects the (sql, parameters) of every statement run on the engine inside the block."""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+
+def sqlite_plan(connection, statement, parameters=()):
+    """The detail lines of SQLite's EXPLAIN QUERY PLAN for a statement."""
+    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def plan_problems(plan, tables):
+    """
+    Lines of a plan that read one of `tables` in full (a SCAN, with or
+    without a covering index) or sort the result in a temporary B-tree.
+    """
+    problems = []
+    for detail in plan:
+        words = detail.split()
+        if words[:1] == ['SCAN'] and len(words) > 1 and words[1] in tables:
+            problems.append(detail)
+        elif detail.startswith('USE TEMP B-TREE'):
+            problems.append(detail)
+    return problems
+
+
+def query_plans(engine, run):
+    """The SQLite plan of every statement run() executes on the engine."""
+    with captured_statements(engine) as statements:
+        run()
+    with engine.connect() as connection:
+        return [sqlite_plan(connection, statement, parameters) for statement, parameters in statements]
@@ -0,0 +1,98 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    """Raised when a JobQueue already holds its maximum number of pending jobs."""
+
+
+def encode_faces(image_bytes, detection_options=None, ingest_options=None, quality_options=None):
+    """
+    Detects and encodes every usable face in an uploaded photo and returns
+    (face_locations, face_encodings, rejected). Runs inside a pool process,
+    so it only takes and returns picklable values; detection_options are
+    passed on to face_detection.find_faces, ingest_options to
+    image_ingest.load_image and quality_options to face_quality.assess_faces.
+    """
+    import face_recognition
+    from face_detection import find_faces
+    from face_quality import assess_faces
+    from image_ingest import load_image
+    options = dict(detection_options or {})
+    # Already inside a pool process, which may not start pools of its own.
+    options['workers'] = 1
+    image = load_image(image_bytes, **(ingest_options or {}))
+    face_locations = find_faces(image, **options)
+    kept, rejected = assess_faces(image, face_locations, **(quality_options or {}))
+    face_locations = [face_locations[i] for i in kept]
+    return face_locations, face_recognition.face_encodings(image, face_locations), rejected
+
+
+class JobQueue:
+    """
+    A bounded front for a local process pool. At most `max_workers` photos
+    are processed at once and at most `max_pending` may be queued or running;
+    beyond that submit() raises QueueFull so a burst of uploads at the start
+    of class gets a quick "try again" instead of tying up web workers.
+    Callbacks run on `callback_threads` threads of their own, never on the
+    pool's manager thread, which would otherwise stop collecting results
+    and feeding the pool while a callback waits on the database.
+    """
+
+    def __init__(self, max_workers=2, max_pending=8, callback_threads=2):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.callback_threads = callback_threads
+        self._executor = None
+        self._callbacks = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def submit(self, fn, *args, callback=None):
+        """
+        Run fn(*args) in the pool. callback(future) is called from one of
+        the callback threads once it finishes, whether it succeeded or not.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull()
+            if self._executor is None:
+                # Created on first use so the pool forks from the serving
+                # worker rather than from the gunicorn master.
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                self._callbacks = ThreadPoolExecutor(max_workers=self.callback_threads)
+            callbacks = self._callbacks
+            self._pending += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        if callback is not None:
+            future.add_done_callback(lambda done: callbacks.submit(self._run_callback, callback, done))
+        return future
+
+    @staticmethod
+    def _run_callback(callback, future):
+        try:
+            callback(future)
+        except Exception as e:
+            print(f"Job callback error: {e}")
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            callbacks, self._callbacks = self._callbacks, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if callbacks is not None:
+            callbacks.shutdown(wait=True)
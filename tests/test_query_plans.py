@@ -0,0 +1,31 @@
+import pytest
+from flask import Flask
+
+from models import db
+from query_plans import HOT_TABLES, hot_queries, plan_problems, query_plans
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'plans.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def test_plan_problems_flags_scans_and_temp_sorts():
+    assert plan_problems(['SCAN attendance_record'], HOT_TABLES) == ['SCAN attendance_record']
+    assert plan_problems(['SCAN student USING COVERING INDEX ix_student_qualification_id'], HOT_TABLES)
+    assert plan_problems(['USE TEMP B-TREE FOR ORDER BY'], HOT_TABLES) == ['USE TEMP B-TREE FOR ORDER BY']
+    assert plan_problems(['SCAN module', 'SEARCH student USING INDEX ix_student_qualification_id (qualification_id=?)'], HOT_TABLES) == []
+
+
+@pytest.mark.parametrize('name, run', hot_queries())
+def test_attendance_queries_use_indexes(app, name, run):
+    plans = query_plans(db.engine, run)
+    assert plans
+    for plan in plans:
+        assert plan_problems(plan, HOT_TABLES) == []